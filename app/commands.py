@@ -1,8 +1,7 @@
 from helpers.pycordapi import DiscordBot
-from helpers.gcp_ai import GCPAI
-from helpers.gcp_vertexai_rag import QuestionAnsweringSystem
-from helpers.gcp_storage import GCPStorage
+from helpers.services import services
 from helpers.common_func import Helpers
+from helpers.dispatcher import Dispatcher
 import discord
 from discord.ext import commands
 from datetime import datetime
@@ -12,13 +11,35 @@ import logging
 logger = logging.getLogger(__name__)
 
 helpers = Helpers()
+# Fetch every secret needed at startup in one concurrent round
+services.secrets.get_secrets(DiscordBot.REQUIRED_SECRETS + ["creds-json"])
+services.secrets.start_background_refresh()
 pycordapi = DiscordBot()
-gcpaiapi = GCPAI()
-qa_system = QuestionAnsweringSystem()
-gcsapi = GCPStorage()
+gcpaiapi = services.gcpai
+gcsapi = services.storage
+dispatcher = Dispatcher()
+
+# Set to False to always hit the model for a command
+RESPONSE_CACHE_ENABLED = {
+    "gemini": True,
+    "py": True,
+    "lang": True,
+    "pycode": True,
+}
 
 
 bot = pycordapi.bot_initiate()
+_close_bot = bot.close
+
+
+async def close_bot():
+    # The RAG stack holds an aiohttp session bound to the bot's event loop
+    if services.is_built("qa_system"):
+        await services.qa_system.aclose()
+    await _close_bot()
+
+
+bot.close = close_bot
 
 
 @bot.event
@@ -35,6 +56,43 @@ async def test(ctx, *, args):
     await ctx.send(f"""Testing. Here is the received message:\n{received_msg}""")
 
 
+@bot.command(help="Show queue depth and running calls per model worker pool")
+async def stats(ctx):
+    lines = [
+        f"`{key}`: {info['running']}/{info['limit']} running, {info['queued']} queued"
+        for key, info in dispatcher.stats().items()
+    ]
+    lines += [
+        f"`{key}`: {count} in flight (async, limit {gcpaiapi.async_limits[key]})"
+        for key, count in gcpaiapi.async_inflight.items()
+    ]
+    cache_stats = gcpaiapi.response_cache.stats()
+    lines.append(
+        f"Response cache: {cache_stats['size']} entries, "
+        f"{cache_stats['hits']} hits, {cache_stats['misses']} misses"
+    )
+    flights = [("Model", gcpaiapi.single_flight)]
+    if services.is_built("qa_system"):
+        flights.append(("RAG", services.qa_system.single_flight))
+        answer_stats = services.qa_system.answer_cache.stats()
+        lines.append(
+            f"RAG answer cache: {answer_stats['size']} entries, "
+            f"{answer_stats['hits']} hits, {answer_stats['misses']} misses"
+        )
+    for name, flight in flights:
+        flight_stats = flight.stats()
+        lines.append(
+            f"{name} requests: {flight_stats['calls']} total, "
+            f"{flight_stats['shared']} coalesced"
+        )
+    await ctx.send(
+        embed=pycordapi.get_embed(
+            "\n".join(lines) or "No model calls dispatched yet",
+            discord.Colour.from_rgb(31, 102, 138),
+        )
+    )
+
+
 @bot.command(
     pass_context=True, help="Clear a specified number of previous messages from channel"
 )
@@ -157,13 +215,19 @@ async def hist(ctx, limit: int = 10):
     guild_ids=[pycordapi.TEST_SER_ID, pycordapi.DC_SER_ID, pycordapi.DEMO_SER_ID],
     description="Gemini RAG for Formula 1 info",
 )
-async def rag(ctx, *, question):
+async def rag(ctx, *, question, corpus: str = None):
     await ctx.defer()
     received_msg = "".join(question)
     logger.info(f"Received message: {received_msg} from user {ctx.author} ")
 
     try:
-        ans = qa_system.ask(received_msg)
+        # The RAG stack is built on the first /rag call, inside the worker pool,
+        # after which questions run concurrently on the event loop
+        if services.is_built("qa_system"):
+            qa_system = services.qa_system
+        else:
+            qa_system = await dispatcher.run("rag", lambda: services.qa_system)
+        ans = await qa_system.ask_async(received_msg, corpus=corpus)
     except Exception as e:
         await ctx.respond(f"Response Error from Google API\n```{e}```")
         return
@@ -191,23 +255,20 @@ async def gemini(ctx, *, prompt):
     logger.info(f"Received message: {received_msg} from user {ctx.author} ")
 
     try:
-        gemini_response = gcpaiapi.get_response(
-            received_msg, response_type="gem", use_existing_session=False
-        )
-    except Exception as e:
-        await ctx.respond(f"Response Error from Google API\n```{e}```")
-        return
-
-    response_chunks = pycordapi.split_response(gemini_response, 1000)
-
-    for chunk in response_chunks:
-        embed = pycordapi.format_embed(
-            chunk,
+        await pycordapi.respond_stream(
+            ctx,
+            gcpaiapi.astream_response(
+                received_msg,
+                response_type="gem",
+                use_existing_session=False,
+                use_cache=RESPONSE_CACHE_ENABLED["gemini"],
+            ),
             "Google Gemini Powered AI Bot",
             discord.Colour.blurple(),
             "Gemini",
         )
-        await ctx.respond(embed=embed)
+    except Exception as e:
+        await ctx.respond(f"Response Error from Google API\n```{e}```")
 
 
 @bot.slash_command(
@@ -221,23 +282,20 @@ async def py(ctx, *, prompt):
     logger.info(f"Received message: {received_msg} from user {ctx.author} ")
 
     try:
-        gemini_response = gcpaiapi.get_response(
-            received_msg, response_type="gem_code", use_existing_session=False
-        )
-    except Exception as e:
-        await ctx.respond(f"Response Error from Google API\n```{e}```")
-        return
-
-    response_chunks = pycordapi.split_response(gemini_response, 1000)
-
-    for chunk in response_chunks:
-        embed = pycordapi.format_embed(
-            chunk,
+        await pycordapi.respond_stream(
+            ctx,
+            gcpaiapi.astream_response(
+                received_msg,
+                response_type="gem_code",
+                use_existing_session=False,
+                use_cache=RESPONSE_CACHE_ENABLED["py"],
+            ),
             "Google Gemini Powered Python Assistant AI Bot",
             discord.Colour.blurple(),
             "Gemini",
         )
-        await ctx.respond(embed=embed)
+    except Exception as e:
+        await ctx.respond(f"Response Error from Google API\n```{e}```")
 
 
 @bot.slash_command(
@@ -251,8 +309,11 @@ async def lang(ctx, *, prompt):
     logger.info(f"Received message: {received_msg} from user {ctx.author} ")
 
     try:
-        response = gcpaiapi.get_response(
-            received_msg, response_type="chat", use_existing_session=False
+        response = await gcpaiapi.aget_response(
+            received_msg,
+            response_type="chat",
+            use_existing_session=False,
+            use_cache=RESPONSE_CACHE_ENABLED["lang"],
         )
     except Exception as e:
         await ctx.respond(f"Response Error from Google API\n```{e}```")
@@ -281,8 +342,11 @@ async def pycode(ctx, *, prompt):
     logger.info(f"Received message: {received_msg} from user {ctx.author} ")
 
     try:
-        pycode_response = gcpaiapi.get_response(
-            received_msg, response_type="code_chat", use_existing_session=False
+        pycode_response = await gcpaiapi.aget_response(
+            received_msg,
+            response_type="code_chat",
+            use_existing_session=False,
+            use_cache=RESPONSE_CACHE_ENABLED["pycode"],
         )
     except Exception as e:
         await ctx.respond(f"Response Error from Google API\n```{e}```")
@@ -323,7 +387,9 @@ async def img(ctx, *, prompt, style: str = None):
     key_word = helpers.get_file_suffix(received_msg)
 
     try:
-        response = gcpaiapi.get_img_url(received_msg, key_word, style)
+        response = await dispatcher.run(
+            "img", gcpaiapi.get_img_url, received_msg, key_word, style
+        )
     except Exception as e:
         await ctx.respond(
             f"Response Error from Google API\n```The response is blocked, as it may violate our policies```"
@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """Runs blocking model calls on a bounded worker pool per response type,
+    so a slow backend never blocks the pycord event loop."""
+
+    DEFAULT_LIMITS = {
+        "gem": 8,
+        "gem_code": 8,
+        "chat": 4,
+        "code_chat": 4,
+        "rag": 4,
+        "img": 2,
+    }
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None) -> None:
+        self.limits = {**self.DEFAULT_LIMITS, **(limits or {})}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._queued: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self, key: str) -> ThreadPoolExecutor:
+        with self._lock:
+            if key not in self._executors:
+                self._executors[key] = ThreadPoolExecutor(
+                    max_workers=self.limits.get(key, 4),
+                    thread_name_prefix=f"dispatch-{key}",
+                )
+                self._queued[key] = 0
+                self._running[key] = 0
+            return self._executors[key]
+
+    def _dequeue(self, key: str, job: dict) -> None:
+        # Called with the lock held by the worker starting the job or by the
+        # caller leaving run(), whichever comes first. A job cancelled while
+        # still queued never reaches the worker.
+        if not job["dequeued"]:
+            job["dequeued"] = True
+            self._queued[key] -= 1
+
+    def _track(self, key: str, job: dict, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            self._dequeue(key, job)
+            self._running[key] += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running[key] -= 1
+
+    async def run(self, key: str, func: Callable, *args, **kwargs) -> Any:
+        executor = self._get_executor(key)
+        job = {"dequeued": False}
+        with self._lock:
+            self._queued[key] += 1
+        loop = asyncio.get_running_loop()
+        logger.debug(f"Dispatching {key} call, queue depth {self.queue_depth(key)}")
+        try:
+            return await loop.run_in_executor(
+                executor,
+                functools.partial(self._track, key, job, func, *args, **kwargs),
+            )
+        finally:
+            with self._lock:
+                self._dequeue(key, job)
+
+    def queue_depth(self, key: Optional[str] = None) -> Any:
+        with self._lock:
+            if key is not None:
+                return self._queued.get(key, 0)
+            return dict(self._queued)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                key: {
+                    "limit": self.limits.get(key, 4),
+                    "queued": self._queued[key],
+                    "running": self._running[key],
+                }
+                for key in self._executors
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executors = list(self._executors.values())
+        for executor in executors:
+            executor.shutdown(wait=wait)
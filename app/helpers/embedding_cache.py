@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Each on-disk record is a sha256 key, the vector dimension and the float32 values
+RECORD_HEADER = struct.Struct("<32sI")
+
+
+class EmbeddingCache:
+    """Embedding vectors keyed by (model_name, text hash). Recent vectors live
+    in a bounded in-memory LRU, and every vector is appended to a compact
+    float32 file so that restarts keep the cache warm."""
+
+    def __init__(self, path: Optional[str] = None, max_items: int = 10000) -> None:
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._offsets: Dict[bytes, tuple] = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._file = open(os.path.join(path, "vectors.bin"), "a+b")
+            self._load_offsets()
+
+    @staticmethod
+    def key(model_name: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+    def _load_offsets(self) -> None:
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        offset = 0
+        while offset + RECORD_HEADER.size <= size:
+            header = os.pread(self._file.fileno(), RECORD_HEADER.size, offset)
+            key, dim = RECORD_HEADER.unpack(header)
+            end = offset + RECORD_HEADER.size + dim * 4
+            if end > size:
+                # A write was interrupted, drop the partial record
+                self._file.truncate(offset)
+                break
+            self._offsets[key] = (offset + RECORD_HEADER.size, dim)
+            offset = end
+        logger.info(f"Loaded {len(self._offsets)} cached embeddings from disk")
+
+    def _read(self, key: bytes) -> Optional[np.ndarray]:
+        if key not in self._offsets:
+            return None
+        offset, dim = self._offsets[key]
+        data = os.pread(self._file.fileno(), dim * 4, offset)
+        return np.frombuffer(data, dtype=np.float32)
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get_many(
+        self, model_name: str, texts: Sequence[str]
+    ) -> List[Optional[List[float]]]:
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(model_name, text)
+                vector = self._memory.get(key)
+                if vector is None and self._file is not None:
+                    vector = self._read(key)
+                if vector is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._remember(key, vector)
+                results.append(vector.tolist())
+        return results
+
+    def set_many(
+        self,
+        model_name: str,
+        texts: Sequence[str],
+        vectors: Sequence[Sequence[float]],
+    ) -> None:
+        with self._lock:
+            for text, values in zip(texts, vectors):
+                key = self.key(model_name, text)
+                vector = np.asarray(values, dtype=np.float32)
+                self._remember(key, vector)
+                if self._file is None or key in self._offsets:
+                    continue
+                self._file.seek(0, os.SEEK_END)
+                offset = self._file.tell()
+                self._file.write(RECORD_HEADER.pack(key, vector.shape[0]))
+                self._file.write(vector.tobytes())
+                self._offsets[key] = (offset + RECORD_HEADER.size, vector.shape[0])
+            if self._file is not None:
+                self._file.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory": len(self._memory),
+                "disk": len(self._offsets),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
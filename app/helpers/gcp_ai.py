@@ -14,18 +14,21 @@ from vertexai.language_models import (
     ChatMessage,
 )
 from helpers.prompts import Prompts
-from helpers.gcp_secrets import GCPSecrets
-from helpers.gcp_storage import GCPStorage
 from helpers.common_func import Helpers
+from helpers.services import services
+from helpers.response_cache import ResponseCache
+from helpers.single_flight import SingleFlight
+from helpers.session_pool import ChatSessionPool
+import asyncio
 import base64
+from contextlib import contextmanager
+from functools import cached_property
 from datetime import datetime
 from os import getenv
 
 GCP_PROJECT = getenv("GCP_PROJECT_ID")
 helpers = Helpers()
 prompts = Prompts()
-secrets = GCPSecrets()
-gcsapi = GCPStorage()
 
 
 class GCPAI:
@@ -92,42 +95,74 @@ class GCPAI:
 
         self.agents_config = {
             "gem": {
+                "model_name": "gemini-pro",
                 "agent": self.gem_agent,
-                "model": GenerativeModel("gemini-pro"),
+                "model": self.gem_model,
                 "clean_chat_params": {"history": []},
+                "history_attr": "_history",
+                "baseline_history": [],
             },
             "gem_code": {
+                "model_name": "gemini-pro",
                 "agent": self.gem_code_agent,
-                "model": GenerativeModel("gemini-pro"),
+                "model": self.gem_model,
                 "clean_chat_params": {"history": []},
                 "start_chat_params": {"history": self.gem_code_history},
+                "history_attr": "_history",
+                "baseline_history": list(self.gem_code_history),
+                "normalize_prompt": False,
             },
             "chat": {
+                "model_name": "chat-bison@002",
                 "agent": self.chat_agent,
-                "model": ChatModel.from_pretrained("chat-bison@002"),
+                "model": self.chat_model,
                 "clean_chat_params": {"examples": []},
                 "start_chat_params": {
                     "context": self.chat_context,
                     "examples": self.chat_history,
                 },
+                "history_attr": "_message_history",
+                "baseline_history": [],
             },
             "code_chat": {
+                "model_name": "codechat-bison",
                 "agent": self.codechat_agent,
-                "model": CodeChatModel.from_pretrained("codechat-bison"),
+                "model": self.codechat_model,
                 "clean_chat_params": {"message_history": []},
                 "start_chat_params": {
                     "context": self.codechat_context,
                     "message_history": self.codechat_history,
                 },
+                "history_attr": "_message_history",
+                "baseline_history": list(self.codechat_history),
+                "normalize_prompt": False,
             },
         }
+        self.session_pools = {
+            response_type: ChatSessionPool(
+                # The SDK appends every turn to the list it was given, so each
+                # pooled session gets its own copy of the few-shot history
+                factory=lambda info=agent_info: info["model"].start_chat(
+                    **{
+                        key: list(value) if isinstance(value, list) else value
+                        for key, value in info.get("start_chat_params", {}).items()
+                    }
+                ),
+                reset=lambda session, info=agent_info: setattr(
+                    session, info["history_attr"], list(info["baseline_history"])
+                ),
+            )
+            for response_type, agent_info in self.agents_config.items()
+        }
+
+        self.async_limits = {"gem": 16, "gem_code": 16, "chat": 8, "code_chat": 8}
+        self.response_timeout = 60
+        self._semaphores = {}
+        self.async_inflight = {}
+        self.response_cache = ResponseCache(max_size=512, ttl=6 * 60 * 60)
+        self.single_flight = SingleFlight()
 
         self.SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
-        self.gcp_creds = secrets.get_secret("creds-json")
-        self.gcp_creds_dict = helpers.extract_json_string(self.gcp_creds)
-        self.credentials = service_account.Credentials.from_service_account_info(
-            self.gcp_creds_dict, scopes=self.SCOPES
-        )
         self.img_gen5_endpoint = f"https://us-central1-aiplatform.googleapis.com/v1/projects/{GCP_PROJECT}/locations/us-central1/publishers/google/models/imagegeneration:predict"
         self.img_gen2_endpoint = f"https://us-central1-aiplatform.googleapis.com/v1/projects/{GCP_PROJECT}/locations/us-central1/publishers/google/models/imagegeneration@002:predict"
         self.img_styles = [
@@ -139,21 +174,176 @@ class GCPAI:
             "cyberpunk",
             "pop_art",
         ]
-        self.img_bucket = gcsapi.get_gcs_bucket(f"{GCP_PROJECT}-aigen-image")
 
-    def get_response(
-        self, prompt: str, response_type: str, use_existing_session: bool = True
-    ) -> str:
-        agent_info = self.agents_config[response_type]
+    @cached_property
+    def img_bucket(self):
+        return services.storage.get_gcs_bucket(f"{GCP_PROJECT}-aigen-image")
+
+    @cached_property
+    def credentials(self) -> service_account.Credentials:
+        gcp_creds = services.secrets.get_secret("creds-json")
+        gcp_creds_dict = helpers.extract_json_string(gcp_creds)
+        return service_account.Credentials.from_service_account_info(
+            gcp_creds_dict, scopes=self.SCOPES
+        )
+
+    @contextmanager
+    def _checkout_agent(self, response_type: str, use_existing_session: bool):
         if use_existing_session:
-            agent_to_use = agent_info["agent"]
+            yield self.agents_config[response_type]["agent"]
+            return
+        with self.session_pools[response_type].checkout() as session:
+            yield session
+
+    def _get_semaphore(self, response_type: str) -> asyncio.Semaphore:
+        if response_type not in self._semaphores:
+            self._semaphores[response_type] = asyncio.Semaphore(
+                self.async_limits.get(response_type, 8)
+            )
+        return self._semaphores[response_type]
+
+    def _cache_key(self, prompt: str, response_type: str) -> tuple:
+        agent_info = self.agents_config[response_type]
+        if agent_info.get("normalize_prompt", True):
+            prompt = self.response_cache.normalize(prompt)
         else:
-            model = agent_info["model"]
-            agent_to_use = model.start_chat(**agent_info.get("start_chat_params", {}))
+            # Case and indentation change the meaning of code, only trim it
+            prompt = prompt.strip()
+        return (response_type, prompt, agent_info["model_name"])
 
-        response = agent_to_use.send_message(prompt)
+    def _send_message(
+        self, prompt: str, response_type: str, use_existing_session: bool
+    ) -> str:
+        with self._checkout_agent(response_type, use_existing_session) as agent_to_use:
+            response = agent_to_use.send_message(prompt)
         return response.text
 
+    async def _asend_message(
+        self,
+        prompt: str,
+        response_type: str,
+        use_existing_session: bool,
+        timeout: float,
+    ) -> str:
+        self.async_inflight[response_type] = (
+            self.async_inflight.get(response_type, 0) + 1
+        )
+        try:
+            async with self._get_semaphore(response_type):
+                with self._checkout_agent(
+                    response_type, use_existing_session
+                ) as agent_to_use:
+                    try:
+                        response = await asyncio.wait_for(
+                            agent_to_use.send_message_async(prompt), timeout=timeout
+                        )
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(
+                            f"{response_type} response timed out after {timeout}s"
+                        )
+        finally:
+            self.async_inflight[response_type] -= 1
+        return response.text
+
+    def get_response(
+        self,
+        prompt: str,
+        response_type: str,
+        use_existing_session: bool = True,
+        use_cache: bool = True,
+    ) -> str:
+        if use_existing_session:
+            return self._send_message(prompt, response_type, use_existing_session)
+
+        cache_key = self._cache_key(prompt, response_type)
+        if use_cache and (cached := self.response_cache.get(cache_key)) is not None:
+            return cached
+
+        text = self.single_flight.do(
+            cache_key, self._send_message, prompt, response_type, False
+        )
+        if use_cache:
+            self.response_cache.set(cache_key, text)
+        return text
+
+    async def aget_response(
+        self,
+        prompt: str,
+        response_type: str,
+        use_existing_session: bool = True,
+        timeout: float = None,
+        use_cache: bool = True,
+    ) -> str:
+        timeout = timeout or self.response_timeout
+        if use_existing_session:
+            return await self._asend_message(
+                prompt, response_type, use_existing_session, timeout
+            )
+
+        cache_key = self._cache_key(prompt, response_type)
+        if use_cache and (cached := self.response_cache.get(cache_key)) is not None:
+            return cached
+
+        text = await self.single_flight.ado(
+            cache_key, self._asend_message, prompt, response_type, False, timeout
+        )
+        if use_cache:
+            self.response_cache.set(cache_key, text)
+        return text
+
+    async def astream_response(
+        self,
+        prompt: str,
+        response_type: str,
+        use_existing_session: bool = True,
+        timeout: float = None,
+        use_cache: bool = True,
+    ):
+        use_cache = use_cache and not use_existing_session
+        if use_cache:
+            cache_key = self._cache_key(prompt, response_type)
+            if (cached := self.response_cache.get(cache_key)) is not None:
+                yield cached
+                return
+
+        timeout = timeout or self.response_timeout
+        text = ""
+        self.async_inflight[response_type] = (
+            self.async_inflight.get(response_type, 0) + 1
+        )
+        try:
+            async with self._get_semaphore(response_type):
+                with self._checkout_agent(
+                    response_type, use_existing_session
+                ) as agent_to_use:
+                    if response_type.startswith("gem"):
+                        stream = await asyncio.wait_for(
+                            agent_to_use.send_message_async(prompt, stream=True),
+                            timeout=timeout,
+                        )
+                    else:
+                        stream = agent_to_use.send_message_streaming_async(prompt)
+
+                    iterator = stream.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(
+                                iterator.__anext__(), timeout=timeout
+                            )
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise TimeoutError(
+                                f"{response_type} stream stalled for more than {timeout}s"
+                            )
+                        text += chunk.text
+                        yield chunk.text
+        finally:
+            self.async_inflight[response_type] -= 1
+
+        if use_cache:
+            self.response_cache.set(cache_key, text)
+
     def img_gen(self, prompt: str, style: str = None) -> bytes:
         authed_session = google.auth.transport.requests.AuthorizedSession(
             self.credentials
@@ -175,7 +365,7 @@ class GCPAI:
 
     def get_img_url(self, prompt: str, key_word: str, style: str = None) -> str:
         data = self.img_gen(prompt, style)
-        url = gcsapi.upload_img(
+        url = services.storage.upload_img(
             f'{datetime.now().strftime("%Y%m%d")}/image_{datetime.now().strftime("%Y%m%d%H%M%S")}_{key_word}.png',
             self.img_bucket,
             data,
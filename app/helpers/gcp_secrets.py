@@ -1,17 +1,159 @@
 from google.cloud import secretmanager
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv
+from typing import Dict, Iterable
+import json
+import logging
+import os
+import threading
+import time
 
 GCP_PROJECT = getenv("GCP_PROJECT_ID")
+SECRETS_SNAPSHOT_PATH = getenv("SECRETS_SNAPSHOT_PATH")
+SECRETS_SNAPSHOT_KEY = getenv("SECRETS_SNAPSHOT_KEY")
+
+logger = logging.getLogger(__name__)
 
 
 class GCPSecrets:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        ttl: float = 3600,
+        snapshot_path: str = SECRETS_SNAPSHOT_PATH,
+        snapshot_key: str = SECRETS_SNAPSHOT_KEY,
+    ) -> None:
         self.client = secretmanager.SecretManagerServiceClient()
         self.base_url = f"projects/{GCP_PROJECT}/secrets"
+        self.ttl = ttl
+        self._cache = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresh_thread = None
 
-    def get_secret(self, secret):
+        self.snapshot_path = snapshot_path
+        self._fernet = self._get_fernet(snapshot_key) if snapshot_path else None
+        self._load_snapshot()
+
+    @staticmethod
+    def _get_fernet(snapshot_key: str):
+        if not snapshot_key:
+            logger.warning("SECRETS_SNAPSHOT_KEY not set, secret snapshot disabled")
+            return None
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError:
+            logger.warning("cryptography is not installed, secret snapshot disabled")
+            return None
+        try:
+            return Fernet(snapshot_key)
+        except ValueError as e:
+            # A bad key must not stop the bot from starting, secrets still load
+            logger.warning(
+                f"Invalid SECRETS_SNAPSHOT_KEY, secret snapshot disabled: {e}"
+            )
+            return None
+
+    def _load_snapshot(self) -> None:
+        if self._fernet is None or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = json.loads(self._fernet.decrypt(f.read()))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable secret snapshot: {e}")
+            return
+        # Snapshot values are served straight away but count as stale, so the
+        # first read of each one triggers a background refresh.
+        with self._lock:
+            for name, value in snapshot.items():
+                self._cache[name] = (float("-inf"), value)
+        logger.info(f"Loaded {len(snapshot)} secrets from local snapshot")
+
+    def _save_snapshot(self) -> None:
+        if self._fernet is None:
+            return
+        with self._lock:
+            snapshot = {name: value for name, (_, value) in self._cache.items()}
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._fernet.encrypt(json.dumps(snapshot).encode("UTF-8")))
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _fetch(self, secret: str) -> str:
         secret_response = self.client.access_secret_version(
             name=f"{self.base_url}/{secret}/versions/latest"
         )
         creds = secret_response.payload.data.decode("UTF-8")
         return creds
+
+    def _fetch_many(self, secrets: Iterable[str]) -> Dict[str, str]:
+        secrets = list(secrets)
+        with ThreadPoolExecutor(max_workers=len(secrets)) as executor:
+            values = dict(zip(secrets, executor.map(self._fetch, secrets)))
+        fetched_at = time.monotonic()
+        with self._lock:
+            for name, value in values.items():
+                self._cache[name] = (fetched_at, value)
+        try:
+            self._save_snapshot()
+        except OSError as e:
+            logger.warning(f"Failed to write secret snapshot: {e}")
+        return values
+
+    def _refresh_in_background(self, secrets: Iterable[str]) -> None:
+        with self._lock:
+            secrets = [name for name in secrets if name not in self._refreshing]
+            self._refreshing.update(secrets)
+        if not secrets:
+            return
+
+        def refresh():
+            try:
+                self._fetch_many(secrets)
+            except Exception as e:
+                logger.warning(f"Background secret refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(secrets)
+
+        threading.Thread(target=refresh, name="secret-refresh", daemon=True).start()
+
+    def get_secrets(self, secrets: Iterable[str]) -> Dict[str, str]:
+        result, missing, stale = {}, [], []
+        now = time.monotonic()
+        with self._lock:
+            for name in secrets:
+                if name in self._cache:
+                    fetched_at, result[name] = self._cache[name]
+                    if now - fetched_at > self.ttl:
+                        stale.append(name)
+                else:
+                    missing.append(name)
+
+        if missing:
+            result.update(self._fetch_many(missing))
+        if stale:
+            self._refresh_in_background(stale)
+        return result
+
+    def get_secret(self, secret):
+        return self.get_secrets([secret])[secret]
+
+    def start_background_refresh(self, interval: float = None) -> None:
+        if self._refresh_thread is not None:
+            return
+        interval = interval or self.ttl / 2
+
+        def refresh_loop():
+            while True:
+                time.sleep(interval)
+                with self._lock:
+                    secrets = list(self._cache)
+                if secrets:
+                    self._refresh_in_background(secrets)
+
+        self._refresh_thread = threading.Thread(
+            target=refresh_loop, name="secret-refresh-loop", daemon=True
+        )
+        self._refresh_thread.start()
@@ -1,61 +1,197 @@
+import asyncio
+import hashlib
+import logging
 import os
 import textwrap
+import threading
 
 import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Any, Callable, List, Optional, Tuple
 import vertexai
+from google.api_core.exceptions import NotFound, ResourceExhausted
 
 from langchain.chains import RetrievalQA
 from langchain_community.embeddings import VertexAIEmbeddings
 from langchain_google_vertexai import VertexAI
 from langchain.prompts import PromptTemplate
+from langchain_core.pydantic_v1 import PrivateAttr
 
 from utils.matching_engine import MatchingEngine
 from utils.matching_engine_utils import MatchingEngineUtils
+from utils.document_cache import DocumentCache
+from utils.document_loader import DocumentLoader
+from utils.shard_store import ShardDocumentStore
+from utils.local_vector_store import LocalVectorStore
 
 from helpers.prompts import Prompts
-from helpers.gcp_ai import GCPAI
+from helpers.embedding_cache import EmbeddingCache
+from helpers.services import services
+from helpers.response_cache import ResponseCache
+from helpers.single_flight import SingleFlight
+from helpers.rate_limiter import TokenBucket
+from helpers.micro_batcher import MicroBatcher
 
 
+logger = logging.getLogger(__name__)
 prompt = Prompts()
-gcpaiapi = GCPAI()
 
 
 class CustomVertexAIEmbeddings(VertexAIEmbeddings):
     requests_per_minute: int
     num_instances_per_batch: int
+    max_in_flight: int = 4
+    max_retries: int = 5
+    cache: Optional[Any] = None
+    # Concurrent embed_query calls arriving within this many seconds are sent
+    # as one request, set to 0 to disable
+    query_batch_window: float = 0.015
+    _query_batcher: Optional[MicroBatcher] = PrivateAttr(default=None)
 
-    @staticmethod
-    def rate_limit(max_per_minute):
-        period = 60 / max_per_minute
-        print("Waiting")
-        while True:
-            before = time.time()
-            yield
-            after = time.time()
-            elapsed = after - before
-            sleep_time = max(0, period - elapsed)
-            if sleep_time > 0:
-                print(".", end="")
-                time.sleep(sleep_time)
+    @property
+    def limiter(self) -> TokenBucket:
+        # Shared by every instance and caller so the quota is enforced per model
+        return TokenBucket.shared(
+            f"embeddings:{self.model_name}", self.requests_per_minute
+        )
+
+    def _lookup_cache(self, texts: List[str]) -> Tuple[list, List[str]]:
+        if self.cache is None:
+            return [None] * len(texts), list(dict.fromkeys(texts))
+        results = self.cache.get_many(self.model_name, texts)
+        missing = list(
+            dict.fromkeys(text for text, res in zip(texts, results) if res is None)
+        )
+        return results, missing
+
+    def _merge_embeddings(
+        self,
+        texts: List[str],
+        results: list,
+        missing: List[str],
+        missing_embeddings: List[List[float]],
+    ) -> List[List[float]]:
+        if self.cache is not None and missing:
+            self.cache.set_many(self.model_name, missing, missing_embeddings)
+        embeddings = dict(zip(missing, missing_embeddings))
+        return [
+            res if res is not None else embeddings[text]
+            for text, res in zip(texts, results)
+        ]
 
     def embed_documents(
         self, texts: List[str], batch_size: int = 0
     ) -> List[List[float]]:
-        limiter = self.rate_limit(self.requests_per_minute)
-        results = []
-        docs = list(texts)
-
-        while docs:
-            head, docs = (
-                docs[: self.num_instances_per_batch],
-                docs[self.num_instances_per_batch :],
+        texts = list(texts)
+        results, missing = self._lookup_cache(texts)
+        missing_embeddings = self._embed_uncached(missing) if missing else []
+        return self._merge_embeddings(texts, results, missing, missing_embeddings)
+
+    @property
+    def query_batcher(self) -> MicroBatcher:
+        if self._query_batcher is None:
+            self._query_batcher = MicroBatcher(
+                self.embed_documents,
+                window=self.query_batch_window,
+                max_batch_size=self.num_instances_per_batch,
+                max_in_flight=self.max_in_flight,
+                name="query-embeddings",
+                afunc=self.aembed_documents,
             )
-            chunk = self.client.get_embeddings(head)
-            results.extend(chunk)
-            next(limiter)
+        return self._query_batcher
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries are embedded the same way as documents, matching the index
+        if not self.query_batch_window:
+            return self.embed_documents([text])[0]
+        return self.query_batcher(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if not self.query_batch_window:
+            return (await self.aembed_documents([text]))[0]
+        return await self.query_batcher.asubmit(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        results, missing = self._lookup_cache(texts)
+        missing_embeddings = await self._aembed_uncached(missing) if missing else []
+        return self._merge_embeddings(texts, results, missing, missing_embeddings)
+
+    def _batches(self, texts: List[str]) -> Tuple[Callable[[], Tuple[int, int]], int]:
+        """Hands out (start, end) slices of texts to the workers, and returns
+        how many workers are worth starting for them."""
+        lock = threading.Lock()
+        state = {"next": 0}
+        # ResourceExhausted is a requests-per-minute quota, so smaller batches
+        # would only make it worse. The token bucket and backoff handle it.
+        batch_size = self.num_instances_per_batch
 
-        return [r.values for r in results]
+        def take() -> Tuple[int, int]:
+            with lock:
+                start = state["next"]
+                state["next"] = min(len(texts), start + batch_size)
+                return start, state["next"]
+
+        n_batches = -(-len(texts) // batch_size)
+        return take, min(self.max_in_flight, n_batches)
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        results = [None] * len(texts)
+        take, n_workers = self._batches(texts)
+
+        def worker() -> None:
+            while True:
+                start, end = take()
+                if start >= end:
+                    return
+                for attempt in range(self.max_retries + 1):
+                    self.limiter.acquire()
+                    try:
+                        chunk = self.client.get_embeddings(texts[start:end])
+                        break
+                    except ResourceExhausted:
+                        if attempt == self.max_retries:
+                            raise
+                        logger.warning("Embedding quota exceeded, retrying")
+                        time.sleep(2**attempt)
+                results[start:end] = [r.values for r in chunk]
+
+        if n_workers <= 1:
+            # A single batch, e.g. a micro-batch of queries, needs no pool
+            worker()
+            return results
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            workers = [executor.submit(worker) for _ in range(n_workers)]
+            for future in workers:
+                future.result()
+
+        return results
+
+    async def _aembed_uncached(self, texts: List[str]) -> List[List[float]]:
+        results = [None] * len(texts)
+        take, n_workers = self._batches(texts)
+
+        async def worker() -> None:
+            while True:
+                start, end = take()
+                if start >= end:
+                    return
+                for attempt in range(self.max_retries + 1):
+                    await self.limiter.aacquire()
+                    try:
+                        chunk = await self.client.get_embeddings_async(texts[start:end])
+                        break
+                    except ResourceExhausted:
+                        if attempt == self.max_retries:
+                            raise
+                        logger.warning("Embedding quota exceeded, retrying")
+                        await asyncio.sleep(2**attempt)
+                results[start:end] = [r.values for r in chunk]
+
+        await asyncio.gather(*(worker() for _ in range(n_workers)))
+        return results
 
 
 class QuestionAnsweringSystem:
@@ -65,10 +201,36 @@ class QuestionAnsweringSystem:
         self.ME_REGION = "us-central1"
         self.ME_INDEX_NAME = f"{self.PROJECT_ID}-me-index"
         self.ME_EMBEDDING_DIR = f"{self.PROJECT_ID}-me-bucket"
+        # Resolved index, endpoint and deployed index ids, see resolve_resources
+        self.ME_RESOURCE_CACHE = getenv("ME_RESOURCE_CACHE", "/tmp/me-resources.json")
         self.EMBEDDING_QPM = 100
         self.EMBEDDING_NUM_BATCH = 5
+        # Unset keeps the cache in memory, the disk tier grows without a cap
+        self.EMBEDDING_CACHE_DIR = getenv("EMBEDDING_CACHE_DIR")
+        self.DOCUMENT_CACHE_DIR = getenv("DOCUMENT_CACHE_DIR")
+        self.DOCUMENT_CACHE_BYTES = 64 * 1024 * 1024
+        # "blobs" stores one GCS object per chunk, "shards" packs them together
+        self.DOCUMENT_STORE = getenv("RAG_DOCUMENT_STORE", "blobs")
+        self.SHARD_MIRROR_DIR = getenv("SHARD_MIRROR_DIR")
+        # "matching_engine" queries the deployed index, "local" searches in process.
+        # With a local index file, Matching Engine also falls back to it on errors
+        self.VECTOR_BACKEND = getenv("RAG_VECTOR_BACKEND", "matching_engine")
+        # Either Matching Engine JSONL or a directory written by LocalVectorStore.save
+        self.LOCAL_INDEX_PATH = getenv("RAG_LOCAL_INDEX_PATH")
+        self.LOCAL_INDEX_LISTS = int(getenv("RAG_LOCAL_INDEX_LISTS", "0"))
+        if self.VECTOR_BACKEND == "local" and not self.LOCAL_INDEX_PATH:
+            raise ValueError("RAG_VECTOR_BACKEND=local requires RAG_LOCAL_INDEX_PATH")
         self.NUMBER_OF_RESULTS = 1
         self.SEARCH_DISTANCE_THRESHOLD = 0.6
+        # Restrict namespace that separates the corpora sharing one index
+        self.CORPUS_NAMESPACE = "corpus"
+        # Best matches scoring below threshold + margin start a direct Gemini
+        # answer in parallel, in case the context turns out not to help
+        self.BORDERLINE_MARGIN = 0.05
+        # Cached answers are tied to the exact RAG prompt they were generated with
+        self.RAG_PROMPT_VERSION = hashlib.sha256(
+            prompt.RAG_PROMPT.encode("utf-8")
+        ).hexdigest()[:12]
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "creds/creds.json"
 
         vertexai.init(project=self.PROJECT_ID, location=self.REGION)
@@ -77,33 +239,59 @@ class QuestionAnsweringSystem:
             model_name="textembedding-gecko@001",
             requests_per_minute=self.EMBEDDING_QPM,
             num_instances_per_batch=self.EMBEDDING_NUM_BATCH,
+            cache=EmbeddingCache(path=self.EMBEDDING_CACHE_DIR),
         )
 
-        self.mengine = MatchingEngineUtils(
-            self.PROJECT_ID, self.ME_REGION, self.ME_INDEX_NAME
-        )
-
-        (
-            self.ME_INDEX_ID,
-            self.ME_INDEX_ENDPOINT_ID,
-        ) = self.mengine.get_index_and_endpoint()
-
         self.llm = VertexAI(
             model_name="gemini-pro",
             max_output_tokens=8100,
         )
 
-        self.me = MatchingEngine.from_components(
-            project_id=self.PROJECT_ID,
-            region=self.ME_REGION,
-            gcs_bucket_name=f"gs://{self.ME_EMBEDDING_DIR}".split("/")[2],
-            embedding=self.embeddings,
-            index_id=self.ME_INDEX_ID,
-            endpoint_id=self.ME_INDEX_ENDPOINT_ID,
-            credentials_path="creds/creds.json",
+        self.document_cache = DocumentCache(
+            max_bytes=self.DOCUMENT_CACHE_BYTES, path=self.DOCUMENT_CACHE_DIR
         )
+        self.me = None
+        self.ME_INDEX_ID = self.ME_INDEX_ENDPOINT_ID = None
+        if self.VECTOR_BACKEND == "local":
+            # The endpoint may be undeployed, so nothing here may touch it
+            bucket = services.storage.get_gcs_bucket(self.ME_EMBEDDING_DIR)
+        else:
+            self.me = self._connect_matching_engine()
+            bucket = self.me.bucket
+
+        document_store = None
+        if self.DOCUMENT_STORE == "shards":
+            document_store = ShardDocumentStore(
+                bucket, mirror_dir=self.SHARD_MIRROR_DIR
+            )
+            if self.me is not None:
+                self.me.document_store = document_store
 
-        self.retriever = self.me.as_retriever(
+        self.local_store = None
+        if self.LOCAL_INDEX_PATH:
+            if self.me is not None:
+                document_loader = self.me.fetch_documents
+            else:
+                document_loader = DocumentLoader(
+                    bucket, document_store, self.document_cache
+                ).fetch_documents
+            # A directory holds a memory-mapped index written by save()
+            load = (
+                LocalVectorStore.load
+                if os.path.isdir(self.LOCAL_INDEX_PATH)
+                else LocalVectorStore.from_jsonl
+            )
+            self.local_store = load(
+                self.LOCAL_INDEX_PATH,
+                self.embeddings,
+                document_loader=document_loader,
+                n_lists=self.LOCAL_INDEX_LISTS,
+            )
+            if self.me is not None:
+                self.me.fallback_store = self.local_store
+        self.vector_store = self.me if self.me is not None else self.local_store
+
+        self.retriever = self.vector_store.as_retriever(
             search_type="similarity",
             search_kwargs={
                 "k": self.NUMBER_OF_RESULTS,
@@ -130,6 +318,52 @@ class QuestionAnsweringSystem:
         self.qa.combine_documents_chain.llm_chain.llm.verbose = True
 
         self.rag_nores_list = ["apologize", "unable", "not", "no"]
+        self.single_flight = SingleFlight()
+        self.answer_cache = ResponseCache(max_size=256, ttl=24 * 60 * 60)
+        self.speculative_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="rag-speculative"
+        )
+
+    def _connect_matching_engine(self) -> MatchingEngine:
+        self.mengine = MatchingEngineUtils(
+            self.PROJECT_ID, self.ME_REGION, self.ME_INDEX_NAME
+        )
+
+        # Configured or cached ids skip listing every index and endpoint
+        resources = self.mengine.resolve_resources(
+            self.ME_RESOURCE_CACHE,
+            index_id=getenv("ME_INDEX_ID"),
+            index_endpoint_id=getenv("ME_INDEX_ENDPOINT_ID"),
+            deployed_index_id=getenv("ME_DEPLOYED_INDEX_ID"),
+        )
+        try:
+            me = self._create_matching_engine(resources)
+        except (ValueError, NotFound) as e:
+            logger.warning(f"Matching Engine resources are stale ({e}), resolving")
+            resources = self.mengine.resolve_resources(
+                self.ME_RESOURCE_CACHE, refresh=True
+            )
+            me = self._create_matching_engine(resources)
+        self.ME_INDEX_ID = resources["index_id"]
+        self.ME_INDEX_ENDPOINT_ID = resources["index_endpoint_id"]
+        return me
+
+    def _create_matching_engine(self, resources) -> MatchingEngine:
+        return MatchingEngine.from_components(
+            project_id=self.PROJECT_ID,
+            region=self.ME_REGION,
+            gcs_bucket_name=f"gs://{self.ME_EMBEDDING_DIR}".split("/")[2],
+            embedding=self.embeddings,
+            index_id=resources["index_id"],
+            endpoint_id=resources["index_endpoint_id"],
+            deployed_index_id=resources["deployed_index_id"],
+            credentials_path="creds/creds.json",
+            document_cache=self.document_cache,
+        )
+
+    async def aclose(self) -> None:
+        if self.me is not None:
+            await self.me.aclose()
 
     @staticmethod
     def wrap(s) -> str:
@@ -150,22 +384,148 @@ class QuestionAnsweringSystem:
         output += ["." * 80, f"Response: {self.wrap(result['result'])}", "." * 80]
         return "\n  \n".join(output)
 
-    def ask(self, query, k=None, search_distance=None) -> str:
+    def ask(
+        self, query, k=None, search_distance=None, corpus=None, filters=None
+    ) -> str:
         if k is None:
             k = self.NUMBER_OF_RESULTS
         if search_distance is None:
             search_distance = self.SEARCH_DISTANCE_THRESHOLD
-        self.qa.retriever.search_kwargs["search_distance"] = search_distance
-        self.qa.retriever.search_kwargs["k"] = k
-        result = self.qa.invoke({"query": query})
-        output_result = self.formatter(result)
-        if any(word in result["result"].split() for word in self.rag_nores_list):
-            result = gcpaiapi.get_response(
-                query, response_type="gem", use_existing_session=False
-            )
-            output_result = (
-                f"The provided context does not contain information about the question, retrieving answer directly from Gemini."
-                f"\n\n**Gemini Response:**"
-                f"\n{result}"
-            )
-        return output_result
+        filter = self._search_filter(corpus, filters)
+        return self.single_flight.do(
+            (ResponseCache.normalize(query), k, search_distance, repr(filter)),
+            self._ask,
+            query,
+            k,
+            search_distance,
+            filter,
+        )
+
+    async def ask_async(
+        self, query, k=None, search_distance=None, corpus=None, filters=None
+    ) -> str:
+        if k is None:
+            k = self.NUMBER_OF_RESULTS
+        if search_distance is None:
+            search_distance = self.SEARCH_DISTANCE_THRESHOLD
+        filter = self._search_filter(corpus, filters)
+        return await self.single_flight.ado(
+            (ResponseCache.normalize(query), k, search_distance, repr(filter)),
+            self._ask_async,
+            query,
+            k,
+            search_distance,
+            filter,
+        )
+
+    def _search_filter(self, corpus=None, filters=None) -> Optional[dict]:
+        """Restrict namespaces to search, e.g. {"corpus": "f1", "guild": "123"}.
+        Matching Engine applies them server-side on the shared index."""
+        filter = dict(filters or {})
+        if corpus:
+            filter[self.CORPUS_NAMESPACE] = corpus
+        return dict(sorted(filter.items())) or None
+
+    def _answer_cache_key(self, query, docs) -> tuple:
+        # The contents version moves whenever documents are added to the index,
+        # so answers built from older contents are never served again
+        return (
+            ResponseCache.normalize(query),
+            tuple(sorted(doc.metadata.get("datapoint_id", "") for doc in docs)),
+            self.RAG_PROMPT_VERSION,
+            getattr(self.vector_store, "contents_version", 0),
+        )
+
+    def _direct_response(self, query) -> str:
+        return services.gcpai.get_response(
+            query, response_type="gem", use_existing_session=False
+        )
+
+    def _fallback_output(self, response) -> str:
+        return (
+            f"The provided context does not contain information about the question, retrieving answer directly from Gemini."
+            f"\n\n**Gemini Response:**"
+            f"\n{response}"
+        )
+
+    def _ask(self, query, k, search_distance, filter=None) -> str:
+        docs = self.vector_store.similarity_search(
+            query, k=k, search_distance=search_distance, filter=filter
+        )
+        if not docs:
+            # Nothing passed the threshold, the RAG prompt could not help
+            logger.info("No documents passed the search distance, asking Gemini")
+            return self._fallback_output(self._direct_response(query))
+
+        cache_key = self._answer_cache_key(query, docs)
+        if (cached := self.answer_cache.get(cache_key)) is not None:
+            return cached
+        output = self._answer(query, docs, search_distance)
+        self.answer_cache.set(cache_key, output)
+        return output
+
+    def _answer(self, query, docs, search_distance) -> str:
+        speculative = None
+        best_score = max(doc.metadata.get("score", 1.0) for doc in docs)
+        if best_score < search_distance + self.BORDERLINE_MARGIN:
+            speculative = self.speculative_executor.submit(self._direct_response, query)
+
+        answer = self.qa.combine_documents_chain.invoke(
+            {"input_documents": docs, "question": query}
+        )["output_text"]
+        result = {"query": query, "result": answer, "source_documents": docs}
+        if not any(word in answer.split() for word in self.rag_nores_list):
+            if speculative is not None:
+                # Not needed: drop it if queued, otherwise its result is ignored
+                speculative.cancel()
+            return self.formatter(result)
+
+        if speculative is not None:
+            return self._fallback_output(speculative.result())
+        return self._fallback_output(self._direct_response(query))
+
+    async def _adirect_response(self, query) -> str:
+        return await services.gcpai.aget_response(
+            query, response_type="gem", use_existing_session=False
+        )
+
+    async def _ask_async(self, query, k, search_distance, filter=None) -> str:
+        docs = await self.vector_store.asimilarity_search(
+            query, k=k, search_distance=search_distance, filter=filter
+        )
+        if not docs:
+            logger.info("No documents passed the search distance, asking Gemini")
+            return self._fallback_output(await self._adirect_response(query))
+
+        cache_key = self._answer_cache_key(query, docs)
+        if (cached := self.answer_cache.get(cache_key)) is not None:
+            return cached
+        output = await self._aanswer(query, docs, search_distance)
+        self.answer_cache.set(cache_key, output)
+        return output
+
+    async def _aanswer(self, query, docs, search_distance) -> str:
+        speculative = None
+        best_score = max(doc.metadata.get("score", 1.0) for doc in docs)
+        if best_score < search_distance + self.BORDERLINE_MARGIN:
+            speculative = asyncio.ensure_future(self._adirect_response(query))
+
+        try:
+            answer = (
+                await self.qa.combine_documents_chain.ainvoke(
+                    {"input_documents": docs, "question": query}
+                )
+            )["output_text"]
+        except BaseException:
+            if speculative is not None:
+                speculative.cancel()
+            raise
+        result = {"query": query, "result": answer, "source_documents": docs}
+        if not any(word in answer.split() for word in self.rag_nores_list):
+            if speculative is not None:
+                speculative.cancel()
+            return self.formatter(result)
+
+        if speculative is not None:
+            return self._fallback_output(await speculative)
+        return self._fallback_output(await self._adirect_response(query))
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects items submitted from any thread or coroutine within a short
+    window and processes them with a single ``func(items) -> results`` call,
+    handing each caller back its own result.
+
+    With ``afunc``, coroutines are batched separately on their event loop and
+    processed with ``await afunc(items)`` instead of in a worker thread.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[List[Any]], List[Any]],
+        window: float = 0.015,
+        max_batch_size: int = 5,
+        max_in_flight: int = 4,
+        name: str = "micro-batcher",
+        afunc: Optional[Callable[[List[Any]], Awaitable[List[Any]]]] = None,
+    ) -> None:
+        self.func = func
+        self.afunc = afunc
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix=name
+        )
+        self._thread = None
+        self._lock = threading.Lock()
+        # Batching state of asubmit, only touched from the event loop thread
+        self._pending: List[tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._tasks = set()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._collect, name=self.name, daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        return self.submit(item).result()
+
+    async def asubmit(self, item: Any) -> Any:
+        if self.afunc is None:
+            return await asyncio.wrap_future(self.submit(item))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._aprocess(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._process, batch)
+
+    def _process(self, batch: List[tuple]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        logger.debug(f"{self.name} processing batch of {len(batch)}")
+        try:
+            results = self.func([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    async def _aprocess(self, batch: List[tuple]) -> None:
+        async with self._in_flight:
+            self.batches += 1
+            self.items += len(batch)
+            logger.debug(f"{self.name} processing batch of {len(batch)}")
+            try:
+                results = await self.afunc([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        # Callers that were cancelled meanwhile have already given up
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -2,27 +2,35 @@ from discord.ext import commands
 from discord.ui import View, Button
 import discord
 import emoji
-from helpers.gcp_secrets import GCPSecrets
-from helpers.gcp_storage import GCPStorage
+from helpers.services import services
 from datetime import datetime
-
-secrets = GCPSecrets()
-gcsapi = GCPStorage()
+import time
 
 
 class DiscordBot:
+    REQUIRED_SECRETS = [
+        "dc-ser-id1",
+        "dc-ser-id2",
+        "dc-ser-id3",
+        "dc-bot-token",
+        "dc-id",
+    ]
+
     def __init__(self) -> None:
         self.intents = discord.Intents.all()
         self.activity = discord.Activity(
             type=discord.ActivityType.competing, name="/help | !help"
         )
         self.status = discord.Status.online
-        self.TEST_SER_ID = secrets.get_secret("dc-ser-id1")
-        self.DC_SER_ID = secrets.get_secret("dc-ser-id2")
-        self.DEMO_SER_ID = secrets.get_secret("dc-ser-id3")
-        self.TOKEN = secrets.get_secret("dc-bot-token")
-        self.DC_ID = [secrets.get_secret("dc-id")]
-        self.DC_BUCKET = gcsapi.get_gcs_bucket("gcp-prj-123-discord-gcpai-bot")
+        bot_secrets = services.secrets.get_secrets(self.REQUIRED_SECRETS)
+        self.TEST_SER_ID = bot_secrets["dc-ser-id1"]
+        self.DC_SER_ID = bot_secrets["dc-ser-id2"]
+        self.DEMO_SER_ID = bot_secrets["dc-ser-id3"]
+        self.TOKEN = bot_secrets["dc-bot-token"]
+        self.DC_ID = [bot_secrets["dc-id"]]
+        self.DC_BUCKET = services.storage.get_gcs_bucket(
+            "gcp-prj-123-discord-gcpai-bot"
+        )
 
         self.HELP_MSG_DEATILS = {
             "gemini": "**/gemini** followed by question you want to ask\n\nExample:\n\n`/gemini prompt: How far is Mars from Earth`",
@@ -64,6 +72,42 @@ class DiscordBot:
 
         return chunks
 
+    async def respond_stream(
+        self,
+        ctx,
+        stream,
+        description: str,
+        color: discord.Colour,
+        author_name: str,
+        max_length: int = 1000,
+        edit_interval: float = 1.5,
+    ) -> str:
+        text = ""
+        messages = []
+        rendered = []
+        last_render = 0.0
+
+        async def render():
+            chunks = self.split_response(text, max_length)
+            for i, chunk in enumerate(chunks):
+                embed = self.format_embed(chunk, description, color, author_name)
+                if i < len(messages):
+                    if rendered[i] != chunk:
+                        await messages[i].edit(embed=embed)
+                        rendered[i] = chunk
+                else:
+                    messages.append(await ctx.followup.send(embed=embed, wait=True))
+                    rendered.append(chunk)
+
+        async for partial in stream:
+            text += partial
+            if text.strip() and time.monotonic() - last_render >= edit_interval:
+                await render()
+                last_render = time.monotonic()
+
+        await render()
+        return text
+
     @staticmethod
     def format_embed(
         chunk: str,
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """Token-bucket rate limiter usable from threads and coroutines alike.
+
+    Callers reserve a token up front and then wait out their own delay, so
+    concurrent callers are spaced evenly instead of all waking at once."""
+
+    _shared: Dict[str, "TokenBucket"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, requests_per_minute: float, capacity: Optional[float] = None):
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity or max(1.0, requests_per_minute / 10)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, name: str, requests_per_minute: float) -> "TokenBucket":
+        with cls._shared_lock:
+            if name not in cls._shared:
+                cls._shared[name] = cls(requests_per_minute)
+            return cls._shared[name]
+
+    def _reserve(self, tokens: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1) -> None:
+        if wait := self._reserve(tokens):
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1) -> None:
+        if wait := self._reserve(tokens):
+            await asyncio.sleep(wait)
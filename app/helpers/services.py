@@ -0,0 +1,68 @@
+import logging
+import resource
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from helpers.gcp_secrets import GCPSecrets
+from helpers.gcp_storage import GCPStorage
+
+logger = logging.getLogger(__name__)
+
+
+class Services:
+    """Process-wide registry of GCP clients and models. Each one is built on
+    first use and then shared by every module that needs it."""
+
+    def __init__(self) -> None:
+        self._instances: Dict[str, Any] = {}
+        self.build_times: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        if name in self._instances:
+            return self._instances[name]
+        with self._lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = factory()
+                self.build_times[name] = time.perf_counter() - start
+                logger.info(f"Built {name} in {self.build_times[name]:.2f}s")
+        return self._instances[name]
+
+    def is_built(self, name: str) -> bool:
+        return name in self._instances
+
+    @property
+    def secrets(self) -> GCPSecrets:
+        return self._get("secrets", GCPSecrets)
+
+    @property
+    def storage(self) -> GCPStorage:
+        return self._get("storage", GCPStorage)
+
+    @property
+    def gcpai(self):
+        def build():
+            from helpers.gcp_ai import GCPAI
+
+            return GCPAI()
+
+        return self._get("gcpai", build)
+
+    @property
+    def qa_system(self):
+        def build():
+            from helpers.gcp_vertexai_rag import QuestionAnsweringSystem
+
+            return QuestionAnsweringSystem()
+
+        return self._get("qa_system", build)
+
+    @staticmethod
+    def peak_rss_mb() -> float:
+        # ru_maxrss is reported in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+services = Services()
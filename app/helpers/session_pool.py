@@ -0,0 +1,68 @@
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSessionPool:
+    """Keeps pre-built chat sessions for one agent. Sessions are checked out
+    for a single request and reset to their few-shot baseline on check-in."""
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        reset: Callable[[Any], None],
+        size: int = 4,
+        max_idle: int = 16,
+    ) -> None:
+        self._factory = factory
+        self._reset = reset
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+        for _ in range(size):
+            self._idle.append(self._create())
+
+    def _create(self) -> Any:
+        with self._lock:
+            self.created += 1
+        return self._factory()
+
+    def _acquire(self) -> Any:
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+        return self._create()
+
+    def _release(self, session: Any) -> None:
+        try:
+            self._reset(session)
+        except Exception as e:
+            logger.warning(f"Dropping chat session that failed to reset: {e}")
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(session)
+
+    @contextmanager
+    def checkout(self):
+        session = self._acquire()
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "created": self.created,
+                "reused": self.reused,
+            }
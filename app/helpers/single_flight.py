@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls so that only the first one (the
+    leader) reaches the backend and every duplicate waits for its result."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.shared = 0
+        self._inflight: Dict[Hashable, Future] = {}
+        self._async_inflight: Dict[Hashable, asyncio.Future] = {}
+        self._async_waiters: Dict[asyncio.Future, int] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.shared += 1
+
+        if not leader:
+            logger.debug(f"Sharing in-flight call for {key}")
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def ado(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            self.calls += 1
+            task = self._async_inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                self._async_inflight[key] = task
+                task.add_done_callback(lambda done: self._forget(key, done))
+            else:
+                self.shared += 1
+                logger.debug(f"Sharing in-flight call for {key}")
+            self._async_waiters[task] = self._async_waiters.get(task, 0) + 1
+
+        try:
+            # Shield the shared task so one caller being cancelled doesn't
+            # cancel the call for everyone else waiting on it.
+            return await asyncio.shield(task)
+        finally:
+            with self._lock:
+                self._async_waiters[task] -= 1
+                abandoned = self._async_waiters[task] == 0 and not task.done()
+                if self._async_waiters[task] == 0:
+                    del self._async_waiters[task]
+                if abandoned and self._async_inflight.get(key) is task:
+                    # Later callers must start a new call, not join this one
+                    del self._async_inflight[key]
+            if abandoned:
+                # Every caller was cancelled, so nobody needs the result
+                task.cancel()
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        with self._lock:
+            # The key may already belong to a newer call if this one was abandoned
+            if self._async_inflight.get(key) is task:
+                del self._async_inflight[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "shared": self.shared,
+                "inflight": len(self._inflight) + len(self._async_inflight),
+            }
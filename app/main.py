@@ -1,9 +1,14 @@
+import time
+
+STARTUP_TIME = time.perf_counter()
+
 from commands import *
 from os import getenv
 import logging
-import google.cloud.logging
 
 if (env := getenv("ENV")) and env == "prod":
+    import google.cloud.logging
+
     client = google.cloud.logging.Client()
     client.setup_logging()
 
@@ -13,6 +18,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@bot.listen("on_ready")
+async def log_startup_time():
+    logger.info(f"Ready in {time.perf_counter() - STARTUP_TIME:.2f}s")
+
+
 if __name__ == "__main__":
-    logger.info("Discord Bot Starting")
+    logger.info(
+        f"Discord Bot Starting, startup took {time.perf_counter() - STARTUP_TIME:.2f}s, "
+        f"peak RSS {services.peak_rss_mb():.0f} MB"
+    )
     bot.run(pycordapi.TOKEN)
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentCache:
+    """Maps Matching Engine datapoint ids to document content. Keeps an LRU
+    bounded by total bytes in memory, with an optional on-disk tier."""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def _disk_path(self, datapoint_id: str) -> str:
+        if not re.fullmatch(r"[\w-]+", datapoint_id):
+            datapoint_id = hashlib.sha256(datapoint_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, datapoint_id)
+
+    def _remember(self, datapoint_id: str, content: str) -> None:
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if datapoint_id in self._entries:
+            self._size -= len(self._entries.pop(datapoint_id).encode("utf-8"))
+        self._entries[datapoint_id] = content
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted.encode("utf-8"))
+
+    def get(self, datapoint_id: str) -> Optional[str]:
+        with self._lock:
+            if datapoint_id in self._entries:
+                self._entries.move_to_end(datapoint_id)
+                self.hits += 1
+                return self._entries[datapoint_id]
+
+        content = None
+        if self.path:
+            try:
+                with open(self._disk_path(datapoint_id), encoding="utf-8") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(datapoint_id, content)
+        return content
+
+    def set(self, datapoint_id: str, content: str) -> None:
+        with self._lock:
+            self._remember(datapoint_id, content)
+        if self.path:
+            disk_path = self._disk_path(datapoint_id)
+            tmp_path = f"{disk_path}.tmp.{threading.get_ident()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, disk_path)
+
+    def invalidate(self, datapoint_id: str) -> None:
+        with self._lock:
+            if datapoint_id in self._entries:
+                self._size -= len(self._entries.pop(datapoint_id).encode("utf-8"))
+        if self.path:
+            try:
+                os.remove(self._disk_path(datapoint_id))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,53 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from google.cloud import storage
+
+from utils.document_cache import DocumentCache
+from utils.shard_store import ShardDocumentStore
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentLoader:
+    """Reads document contents by datapoint id from the layout MatchingEngine
+    writes (packed shards or one ``documents/<id>`` blob per chunk), for a
+    local index that serves searches without the Matching Engine endpoint."""
+
+    def __init__(
+        self,
+        bucket: storage.Bucket,
+        document_store: Optional[ShardDocumentStore] = None,
+        document_cache: Optional[DocumentCache] = None,
+        max_concurrent_downloads: int = 10,
+    ) -> None:
+        self.bucket = bucket
+        self.document_store = document_store
+        self.document_cache = document_cache or DocumentCache()
+        self._fetch_executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_downloads, thread_name_prefix="gcs-download"
+        )
+
+    def _download(self, datapoint_id: str) -> str:
+        location = f"documents/{datapoint_id}"
+        try:
+            page_content = self.bucket.blob(location).download_as_bytes()
+        except Exception as e:
+            logger.error(f"Failed to download {location} from GCS: {e}")
+            return ""
+        page_content = page_content.decode("utf-8")
+        self.document_cache.set(datapoint_id, page_content)
+        return page_content
+
+    def fetch_documents(self, datapoint_ids: List[str]) -> List[str]:
+        contents = {i: self.document_cache.get(i) for i in datapoint_ids}
+        missing = [i for i, content in contents.items() if content is None]
+        if missing and self.document_store is not None:
+            stored = self.document_store.get_many(missing)
+            for datapoint_id, page_content in stored.items():
+                self.document_cache.set(datapoint_id, page_content)
+            contents.update(stored)
+            missing = [i for i in missing if i not in stored]
+        contents.update(zip(missing, self._fetch_executor.map(self._download, missing)))
+        return [contents[i] for i in datapoint_ids]
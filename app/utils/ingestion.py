@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+from typing import TYPE_CHECKING, Any, Callable, Iterable, List, Optional
+
+from google.cloud import aiplatform_v1
+
+if TYPE_CHECKING:
+    from utils.matching_engine import MatchingEngine
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stream on every stage queue
+_DONE = object()
+
+
+def metadata_to_restricts(
+    metadata: Optional[dict],
+) -> List[aiplatform_v1.IndexDatapoint.Restriction]:
+    return [
+        aiplatform_v1.IndexDatapoint.Restriction(namespace=k, allow_list=[str(v)])
+        for k, v in (metadata or {}).items()
+    ]
+
+
+class IngestionPipeline:
+    """Streams texts into Matching Engine through three concurrent stages
+    (embed, upload, upsert) connected by bounded queues.
+
+    Datapoint ids are derived from the run id and the position of each text,
+    so an interrupted run resumed from its checkpoint skips what was already
+    indexed and re-upserts the unfinished batch under the same ids. Resuming
+    takes the run id of the checkpoint, which is removed once the run finishes.
+    """
+
+    def __init__(
+        self,
+        engine: "MatchingEngine",
+        embed_batch_size: int = 250,
+        upsert_batch_size: int = 100,
+        max_uploads: int = 16,
+        queue_size: int = 4,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = 1000,
+        run_id: Optional[str] = None,
+    ) -> None:
+        self.engine = engine
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self.max_uploads = max_uploads
+        self.queue_size = queue_size
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.run_id = run_id
+        self.completed = 0
+        self._error: Optional[BaseException] = None
+
+    def _load_checkpoint(self) -> None:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            self.run_id = self.run_id or str(uuid.uuid4())
+            return
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if self.run_id != checkpoint["run_id"]:
+            # Resuming skips the first texts, only the caller knows they match
+            raise ValueError(
+                f"Checkpoint {self.checkpoint_path} belongs to run "
+                f"{checkpoint['run_id']}, pass that run_id to resume it or "
+                "remove the checkpoint"
+            )
+        self.run_id = checkpoint["run_id"]
+        self.completed = checkpoint["completed"]
+        logger.info(f"Resuming ingestion run {self.run_id} at {self.completed}")
+
+    def _save_checkpoint(self, completed: int) -> None:
+        if self.engine.document_store is not None:
+            # Shard contents must be durable before the offset moves past them
+            self.engine.document_store.flush()
+        self.completed = completed
+        if not self.checkpoint_path:
+            return
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"run_id": self.run_id, "completed": completed}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def datapoint_id(self, offset: int) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.run_id}/{offset}"))
+
+    def _put(self, q: queue.Queue, item: Any) -> None:
+        # Stop waiting on a full queue once another stage has failed
+        while self._error is None:
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("Ingestion stopped")
+
+    def _get(self, q: queue.Queue) -> Any:
+        while self._error is None:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _stage(
+        self,
+        name: str,
+        inbox: queue.Queue,
+        outbox: Optional[queue.Queue],
+        func: Callable[[List[tuple]], Any],
+    ) -> threading.Thread:
+        def run() -> None:
+            try:
+                while (batch := self._get(inbox)) is not _DONE:
+                    result = func(batch)
+                    if outbox is not None:
+                        self._put(outbox, result)
+                if outbox is not None:
+                    self._put(outbox, _DONE)
+            except BaseException as e:
+                if self._error is None:
+                    logger.error(f"Ingestion {name} stage failed: {e}")
+                    self._error = e
+
+        thread = threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _embed(self, batch: List[tuple]) -> List[tuple]:
+        embeddings = self.engine.embedding.embed_documents(
+            [text for _, text, _ in batch]
+        )
+        return [
+            (offset, self.datapoint_id(offset), text, metadata, embedding)
+            for (offset, text, metadata), embedding in zip(batch, embeddings)
+        ]
+
+    def _upload(self, batch: List[tuple]) -> List[tuple]:
+        list(
+            self._upload_executor.map(
+                lambda item: self.engine._store_document(item[1], item[2], cache=False),
+                batch,
+            )
+        )
+        return batch
+
+    def _upsert(self, batch: List[tuple]) -> None:
+        self._pending.extend(batch)
+        while len(self._pending) >= self.upsert_batch_size:
+            self._flush_upserts(self._pending[: self.upsert_batch_size])
+            self._pending = self._pending[self.upsert_batch_size :]
+
+    def _flush_upserts(self, batch: List[tuple]) -> None:
+        if not batch:
+            return
+        self.engine.index_client.upsert_datapoints(
+            request=aiplatform_v1.UpsertDatapointsRequest(
+                index=self.engine.index_name,
+                datapoints=[
+                    aiplatform_v1.IndexDatapoint(
+                        datapoint_id=datapoint_id,
+                        feature_vector=embedding,
+                        restricts=metadata_to_restricts(metadata),
+                    )
+                    for _, datapoint_id, _, metadata, embedding in batch
+                ],
+            )
+        )
+        completed = batch[-1][0] + 1
+        if completed - self.completed >= self.checkpoint_every:
+            self._save_checkpoint(completed)
+
+    def run(
+        self, texts: Iterable[str], metadatas: Optional[Iterable[dict]] = None
+    ) -> List[str]:
+        self._load_checkpoint()
+        start_offset = self.completed
+        self._pending: List[tuple] = []
+        self._upload_executor = ThreadPoolExecutor(
+            max_workers=self.max_uploads, thread_name_prefix="ingest-upload"
+        )
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        upload_queue = queue.Queue(maxsize=self.queue_size)
+        upsert_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            self._stage("embed", embed_queue, upload_queue, self._embed),
+            self._stage("upload", upload_queue, upsert_queue, self._upload),
+            self._stage("upsert", upsert_queue, None, self._upsert),
+        ]
+
+        started = time.perf_counter()
+        metadatas = metadatas if metadatas is not None else repeat(None)
+        items = islice(enumerate(zip(texts, metadatas)), start_offset, None)
+        total = start_offset
+        try:
+            while batch := list(islice(items, self.embed_batch_size)):
+                self._put(
+                    embed_queue,
+                    [(offset, text, metadata) for offset, (text, metadata) in batch],
+                )
+                total = batch[-1][0] + 1
+            self._put(embed_queue, _DONE)
+        except BaseException as e:
+            # Whatever interrupted the reader, including the texts iterable
+            # itself, the stages must see it or they would wait forever
+            if self._error is None:
+                self._error = e
+        finally:
+            for thread in threads:
+                thread.join()
+            self._upload_executor.shutdown()
+
+        if self._error is not None:
+            raise self._error
+        self._flush_upserts(self._pending)
+        self._save_checkpoint(total)
+        if self.checkpoint_path:
+            # Finished, the next ingest into this path starts a new run
+            os.remove(self.checkpoint_path)
+
+        elapsed = time.perf_counter() - started
+        indexed = total - start_offset
+        logger.info(
+            f"Indexed {indexed} documents in {elapsed:.1f}s "
+            f"({indexed / max(elapsed, 1e-9):.1f} docs/sec)"
+        )
+        return [self.datapoint_id(offset) for offset in range(total)]
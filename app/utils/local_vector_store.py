@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from utils.vector_file import VectorFile, top_k
+
+logger = logging.getLogger(__name__)
+
+
+def _allowed(value: Any, allowed: Any) -> bool:
+    # Same semantics as Matching Engine restricts, a value or a list of values
+    if value is None:
+        return False
+    if isinstance(allowed, (list, tuple, set)):
+        return str(value) in {str(v) for v in allowed}
+    return str(value) == str(allowed)
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector index serving the same similarity_search interface as
+    MatchingEngine. Scores are dot products like the deployed index, searched
+    exactly by default or through an inverted file (IVF) when ``n_lists`` is set.
+
+    Documents are kept inline when the texts are known, otherwise they are
+    fetched with ``document_loader(ids) -> texts`` for the returned ids only.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        document_loader: Optional[Callable[[List[str]], List[str]]] = None,
+        n_lists: int = 0,
+        n_probe: int = 8,
+    ) -> None:
+        self.embedding = embedding
+        self.document_loader = document_loader
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.ids: List[str] = []
+        self.metadatas: List[dict] = []
+        self.texts: Dict[str, str] = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        # Memory-mapped vectors shared with other processes, see load()
+        self.vector_file: Optional[VectorFile] = None
+        self.contents_version = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_embeddings(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        texts: Optional[List[str]] = None,
+    ) -> None:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if len(self.ids) == 0:
+                self.vectors = vectors
+            else:
+                self.vectors = np.vstack([self.vectors, vectors])
+            self.ids.extend(ids)
+            self.metadatas.extend(metadatas or [{} for _ in ids])
+            if texts is not None:
+                self.texts.update(zip(ids, texts))
+            # The inverted lists no longer cover every vector, and the rows now
+            # live in an in-memory copy rather than the mapped file
+            self._centroids = None
+            self.vector_file = None
+            self.contents_version += 1
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        ids = kwargs.get("ids") or [str(uuid.uuid4()) for _ in texts]
+        embeddings = self.embedding.embed_documents(texts)
+        self.add_embeddings(ids, embeddings, metadatas, texts)
+        logger.info(f"Indexed {len(ids)} documents locally.")
+        return ids
+
+    @classmethod
+    def from_texts(
+        cls: Type["LocalVectorStore"],
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas)
+        return store
+
+    @classmethod
+    def from_jsonl(
+        cls: Type["LocalVectorStore"],
+        path: str,
+        embedding: Embeddings,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        """Loads records in the Matching Engine index data format, i.e. one
+        ``{"id", "embedding", "restricts"}`` object per line, with an optional
+        ``"text"`` holding the document content."""
+        ids, embeddings, metadatas, texts = [], [], [], {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                ids.append(str(record["id"]))
+                embeddings.append(record["embedding"])
+                metadatas.append(
+                    {
+                        item["namespace"]: item["allow"][0]
+                        for item in record.get("restricts", [])
+                    }
+                )
+                if "text" in record:
+                    texts[ids[-1]] = record["text"]
+
+        store = cls(embedding, **kwargs)
+        if ids:
+            store.add_embeddings(ids, embeddings, metadatas)
+            store.texts.update(texts)
+        if store.n_lists:
+            store.build_ivf()
+        logger.info(f"Loaded {len(ids)} vectors from {path}")
+        return store
+
+    @classmethod
+    def load(
+        cls: Type["LocalVectorStore"],
+        path: str,
+        embedding: Embeddings,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        """Opens a directory written by save() without reading the vectors into
+        process memory."""
+        vector_file = VectorFile(path)
+        store = cls(embedding, **kwargs)
+        store.ids = vector_file.ids.tolist()
+        store.metadatas = vector_file.metadatas
+        store.vectors = vector_file.vectors
+        store.vector_file = vector_file
+        if store.n_lists:
+            store.build_ivf()
+        logger.info(f"Mapped {len(store.ids)} vectors from {path}")
+        return store
+
+    def save(self, path: str, quantize: bool = True) -> None:
+        VectorFile.write(path, self.ids, self.vectors, self.metadatas, quantize)
+
+    def save_jsonl(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for i, datapoint_id in enumerate(self.ids):
+                record = {
+                    "id": datapoint_id,
+                    "embedding": self.vectors[i].tolist(),
+                    "restricts": [
+                        {"namespace": k, "allow": [str(v)]}
+                        for k, v in self.metadatas[i].items()
+                    ],
+                }
+                if datapoint_id in self.texts:
+                    record["text"] = self.texts[datapoint_id]
+                f.write(json.dumps(record) + "\n")
+
+    def build_ivf(self, n_lists: Optional[int] = None, iterations: int = 10) -> None:
+        """Clusters the vectors with k-means so that a search only scores the
+        ``n_probe`` lists whose centroids are closest to the query."""
+        n_lists = min(n_lists or self.n_lists, len(self.ids))
+        if n_lists < 2:
+            return
+        rng = np.random.default_rng(0)
+        centroids = self.vectors[rng.choice(len(self.ids), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = self.vectors[assignments == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        assignments = np.argmax(self.vectors @ centroids.T, axis=1)
+        with self._lock:
+            self._centroids = centroids
+            self._lists = [np.flatnonzero(assignments == c) for c in range(n_lists)]
+        logger.info(
+            f"Built IVF index with {n_lists} lists over {len(self.ids)} vectors"
+        )
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if self._centroids is None:
+            return None
+        n_probe = min(self.n_probe, len(self._lists))
+        probed = np.argpartition(-(self._centroids @ query), n_probe - 1)[:n_probe]
+        return np.concatenate([self._lists[c] for c in probed])
+
+    def _search_candidates(
+        self, query: np.ndarray, k: int, filter: Optional[dict]
+    ) -> List[Tuple[int, float]]:
+        candidates = self._candidates(query)
+        if filter:
+            positions = candidates if candidates is not None else range(len(self.ids))
+            candidates = np.array(
+                [
+                    i
+                    for i in positions
+                    if all(
+                        _allowed(self.metadatas[i].get(key), values)
+                        for key, values in filter.items()
+                    )
+                ],
+                dtype=np.int64,
+            )
+        idx, scores = top_k((self.vectors[candidates] @ query)[None, :], k)
+        return list(zip(candidates[idx[0]].tolist(), scores[0].tolist()))
+
+    def search_batch(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        filter: Optional[dict] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """Returns (position, score) of the k best vectors of each query, best
+        first."""
+        if len(self.ids) == 0:
+            return [[] for _ in embeddings]
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if filter or self._centroids is not None:
+            return [self._search_candidates(query, k, filter) for query in queries]
+
+        if self.vector_file is not None:
+            idx, scores = self.vector_file.search_batch(queries, k)
+        else:
+            idx, scores = top_k(queries @ self.vectors.T, k)
+        return [
+            list(zip(row_idx.tolist(), row_scores.tolist()))
+            for row_idx, row_scores in zip(idx, scores)
+        ]
+
+    def search(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+    ) -> List[Tuple[int, float]]:
+        return self.search_batch([embedding], k, filter)[0]
+
+    def _to_documents(
+        self, matches: List[Tuple[int, float]], search_distance: float
+    ) -> List[Document]:
+        matches = [(i, score) for i, score in matches if score >= search_distance]
+        ids = [self.ids[i] for i, _ in matches]
+        missing = [i for i in ids if i not in self.texts]
+        if missing and self.document_loader is not None:
+            self.texts.update(zip(missing, self.document_loader(missing)))
+        return [
+            Document(
+                page_content=self.texts.get(self.ids[i], ""),
+                metadata={
+                    **self.metadatas[i],
+                    "score": score,
+                    "datapoint_id": self.ids[i],
+                },
+            )
+            for i, score in matches
+        ]
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        search_distance: float = 0.65,
+        **kwargs: Any,
+    ) -> List[Document]:
+        matches = self.search(embedding, k, kwargs.get("filter"))
+        return self._to_documents(matches, search_distance)
+
+    def similarity_search(
+        self, query: str, k: int = 4, search_distance: float = 0.65, **kwargs: Any
+    ) -> List[Document]:
+        embedding_query = self.embedding.embed_query(query)
+        return self.similarity_search_by_vector(
+            embedding_query, k, search_distance, **kwargs
+        )
+
+    def similarity_search_batch(
+        self,
+        queries: List[str],
+        k: int = 4,
+        search_distance: float = 0.65,
+        **kwargs: Any,
+    ) -> List[List[Document]]:
+        embeddings = self.embedding.embed_documents(list(queries))
+        return [
+            self._to_documents(matches, search_distance)
+            for matches in self.search_batch(embeddings, k, kwargs.get("filter"))
+        ]
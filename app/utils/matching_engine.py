@@ -1,14 +1,19 @@
 from __future__ import annotations
+import asyncio
 import os
 import logging
-import uuid
-from typing import Any, Iterable, List, Optional, Type
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
+from urllib.parse import quote
 
+import aiohttp
 import requests
+import requests.adapters
 import json
 
 from langchain.docstore.document import Document
-from langchain_community.embeddings import TensorflowHubEmbeddings
+from langchain_core.pydantic_v1 import PrivateAttr
 from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.base import VectorStore
 
@@ -21,15 +26,67 @@ from google.oauth2.service_account import Credentials
 import google.auth
 import google.auth.transport.requests
 
+from helpers.micro_batcher import MicroBatcher
+from utils.document_cache import DocumentCache
+from utils.ingestion import IngestionPipeline
+from utils.shard_store import ShardDocumentStore
+
 logger = logging.getLogger()
 
 
+class LazyDocument(Document):
+    """Document whose page_content is only downloaded when first read."""
+
+    _loader = PrivateAttr(default=None)
+    _loaded = PrivateAttr(default=False)
+
+    def __init__(self, loader: Callable[[], str], **kwargs: Any):
+        super().__init__(page_content="", **kwargs)
+        self._loader = loader
+
+    def __getattribute__(self, name: str) -> Any:
+        if name == "page_content" and not object.__getattribute__(self, "_loaded"):
+            object.__getattribute__(self, "load")()
+        return super().__getattribute__(name)
+
+    def load(self) -> None:
+        self.__dict__["page_content"] = self._loader()
+        self._loaded = True
+
+    def dict(self, **kwargs: Any) -> dict:
+        if not self._loaded:
+            self.load()
+        return super().dict(**kwargs)
+
+
+class _DocumentBatch:
+    """Downloads every document of one search result together, the first
+    time any of them is read."""
+
+    def __init__(self, engine: "MatchingEngine", datapoint_ids: List[str]):
+        self.engine = engine
+        self.datapoint_ids = datapoint_ids
+        self._contents: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+    def get(self, datapoint_id: str) -> str:
+        with self._lock:
+            if self._contents is None:
+                self._contents = dict(
+                    zip(
+                        self.datapoint_ids,
+                        self.engine.fetch_documents(self.datapoint_ids),
+                    )
+                )
+        return self._contents[datapoint_id]
+
+
 class MatchingEngine(VectorStore):
     def __init__(
         self,
         project_id: str,
         region: str,
-        index: MatchingEngineIndex,
+        index: Optional[MatchingEngineIndex],
         endpoint: MatchingEngineIndexEndpoint,
         embedding: Embeddings,
         gcs_client: storage.Client,
@@ -37,13 +94,26 @@ class MatchingEngine(VectorStore):
         index_endpoint_client: aiplatform_v1.IndexEndpointServiceClient,
         gcs_bucket_name: str,
         credentials: Credentials,
+        query_batch_window: float = 0.01,
+        max_queries_per_request: int = 16,
+        request_timeout: float = 10,
+        max_connections: int = 10,
+        document_cache: Optional[DocumentCache] = None,
+        lazy_documents: bool = False,
+        max_concurrent_downloads: int = 10,
+        document_store: Optional[ShardDocumentStore] = None,
+        fallback_store: Optional[VectorStore] = None,
+        index_name: Optional[str] = None,
+        deployed_index_id: Optional[str] = None,
     ):
         super().__init__()
         self._validate_google_libraries_installation()
 
         self.project_id = project_id
         self.region = region
-        self.index = index
+        # The full index resource is only fetched if something reads it
+        self._index = index
+        self.index_name = index_name or index.name
         self.endpoint = endpoint
         self.embedding = embedding
         self.gcs_client = gcs_client
@@ -59,6 +129,37 @@ class MatchingEngine(VectorStore):
         )
         self.credentials = self.creds
         self.gcs_bucket_name = gcs_bucket_name
+        self._bucket = None
+        self.document_cache = document_cache or DocumentCache()
+        self.lazy_documents = lazy_documents
+        # Packed shard storage, documents are stored one blob per chunk if unset
+        self.document_store = document_store
+        # Local replica answering searches while the endpoint is unreachable
+        self.fallback_store = fallback_store
+        # Bumped on every add_texts so that answer caches can detect new contents
+        self.contents_version = 0
+        self._fetch_executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_downloads, thread_name_prefix="gcs-download"
+        )
+        self.query_batch_window = query_batch_window
+        self.max_queries_per_request = max_queries_per_request
+        self._query_batcher = None
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self._aiohttp_session = None
+        self.http_session = self._create_http_session(self.credentials, max_connections)
+        self.deployed_index_id = deployed_index_id or self._get_index_id()
+
+    @staticmethod
+    def _create_http_session(
+        credentials: Credentials, max_connections: int
+    ) -> google.auth.transport.requests.AuthorizedSession:
+        session = google.auth.transport.requests.AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        session.mount("https://", adapter)
+        return session
 
     def _validate_google_libraries_installation(self) -> None:
         """Validates that Google libraries that are needed are installed."""
@@ -75,118 +176,228 @@ class MatchingEngine(VectorStore):
     def add_texts(
         self,
         texts: Iterable[str],
-        metadatas: Optional[List[dict]] = None,
+        metadatas: Optional[Iterable[dict]] = None,
         **kwargs: Any,
     ) -> List[str]:
-        logger.debug("Embedding documents.")
-        embeddings = self.embedding.embed_documents(list(texts))
-        insert_datapoints_payload = []
-        ids = []
-
-        # Streaming index update
-        for idx, (embedding, text, metadata) in enumerate(
-            zip(embeddings, texts, metadatas)
-        ):
-            id = uuid.uuid4()
-            ids.append(id)
-            self._upload_to_gcs(text, f"documents/{id}")
-            metadatas[idx]
-            insert_datapoints_payload.append(
-                aiplatform_v1.IndexDatapoint(
-                    datapoint_id=str(id),
-                    feature_vector=embedding,
-                    restricts=metadata if metadata else [],
-                )
-            )
-            if idx % 100 == 0:
-                upsert_request = aiplatform_v1.UpsertDatapointsRequest(
-                    index=self.index.name, datapoints=insert_datapoints_payload
-                )
-                response = self.index_client.upsert_datapoints(request=upsert_request)
-                insert_datapoints_payload = []
-        if len(insert_datapoints_payload) > 0:
-            upsert_request = aiplatform_av1.UpsertDatapointsRequest(
-                index=self.index.name, datapoints=insert_datapoints_payload
-            )
-            _ = self.index_client.upsert_datapoints(request=upsert_request)
-
-        logger.debug("Updated index with new configuration.")
+        """Streams texts through the ingestion pipeline. Keyword arguments are
+        passed to IngestionPipeline, e.g. checkpoint_path and run_id to make a
+        large ingest resumable."""
+        try:
+            ids = IngestionPipeline(self, **kwargs).run(texts, metadatas)
+        finally:
+            # Even a partial ingest changes what searches can return
+            self.contents_version += 1
         logger.info(f"Indexed {len(ids)} documents to Matching Engine.")
-
         return ids
 
+    @property
+    def index(self) -> MatchingEngineIndex:
+        if self._index is None:
+            self._index = self.index_client.get_index(
+                request=aiplatform_v1.GetIndexRequest(name=self.index_name)
+            )
+        return self._index
+
+    @property
+    def bucket(self) -> storage.Bucket:
+        # bucket() builds a handle without the metadata GET that get_bucket() does
+        if self._bucket is None:
+            self._bucket = self.gcs_client.bucket(self.gcs_bucket_name)
+        return self._bucket
+
+    def _store_document(self, datapoint_id: str, text: str, cache: bool = True) -> None:
+        if self.document_store is not None:
+            self.document_store.add(datapoint_id, text)
+        else:
+            self._upload_to_gcs(text, f"documents/{datapoint_id}")
+        if cache:
+            self.document_cache.set(datapoint_id, text)
+        else:
+            # Ids are deterministic, a rerun must not keep serving the old text
+            self.document_cache.invalidate(datapoint_id)
+
     def _upload_to_gcs(self, data: str, gcs_location: str) -> None:
-        bucket = self.gcs_client.get_bucket(self.gcs_bucket_name)
-        blob = bucket.blob(gcs_location)
+        blob = self.bucket.blob(gcs_location)
         blob.upload_from_string(data)
 
-    def get_matches(
+    @staticmethod
+    def _filter_to_restricts(filter: Optional[dict]) -> List[dict]:
+        """Turns {namespace: value or list of values} into query restricts,
+        which the index applies server-side before picking the neighbors."""
+        return [
+            {
+                "namespace": namespace,
+                "allowList": (
+                    [str(v) for v in values]
+                    if isinstance(values, (list, tuple, set))
+                    else [str(values)]
+                ),
+            }
+            for namespace, values in (filter or {}).items()
+        ]
+
+    def _find_neighbors_request(
         self,
-        embeddings: List[str],
-        n_matches: int,
+        embeddings: List[List[float]],
+        n_matches: Union[int, List[int]],
         index_endpoint: MatchingEngineIndexEndpoint,
-    ) -> str:
+        filters: Union[None, dict, List[Optional[dict]]] = None,
+    ) -> Tuple[str, str]:
+        if isinstance(n_matches, int):
+            n_matches = [n_matches] * len(embeddings)
+        if filters is None or isinstance(filters, dict):
+            filters = [filters] * len(embeddings)
+
         request_data = {
-            "deployed_index_id": index_endpoint.deployed_indexes[0].id,
+            "deployed_index_id": self.deployed_index_id,
             "return_full_datapoint": True,
             "queries": [
                 {
-                    "datapoint": {"datapoint_id": f"{i}", "feature_vector": emb},
-                    "neighbor_count": n_matches,
+                    "datapoint": {
+                        "datapoint_id": f"{i}",
+                        "feature_vector": emb,
+                        "restricts": self._filter_to_restricts(filter),
+                    },
+                    "neighbor_count": n,
                 }
-                for i, emb in enumerate(embeddings)
+                for i, (emb, n, filter) in enumerate(
+                    zip(embeddings, n_matches, filters)
+                )
             ],
         }
 
         endpoint_address = self.endpoint.public_endpoint_domain_name
         rpc_address = f"https://{endpoint_address}/v1beta1/{index_endpoint.resource_name}:findNeighbors"
-        endpoint_json_data = json.dumps(request_data)
+        return rpc_address, json.dumps(request_data)
 
-        logger.debug(f"Querying Matching Engine Index Endpoint {rpc_address}")
+    def get_matches(
+        self,
+        embeddings: List[str],
+        n_matches: Union[int, List[int]],
+        index_endpoint: MatchingEngineIndexEndpoint,
+        filters: Union[None, dict, List[Optional[dict]]] = None,
+    ) -> str:
+        rpc_address, endpoint_json_data = self._find_neighbors_request(
+            embeddings, n_matches, index_endpoint, filters
+        )
 
-        request = google.auth.transport.requests.Request()
-        self.credentials.refresh(request)
-        header = {"Authorization": "Bearer " + self.credentials.token}
+        logger.debug(f"Querying Matching Engine Index Endpoint {rpc_address}")
 
-        return requests.post(rpc_address, data=endpoint_json_data, headers=header)
+        # The authorized session only refreshes the token when it is close to
+        # expiry and reuses pooled keep-alive connections to the endpoint
+        return self.http_session.post(
+            rpc_address,
+            data=endpoint_json_data,
+            headers={"Content-Type": "application/json"},
+            timeout=self.request_timeout,
+        )
 
-    def similarity_search(
-        self, query: str, k: int = 4, search_distance: float = 0.65, **kwargs: Any
-    ) -> List[Document]:
-        logger.debug(f"Embedding query {query}.")
-        embedding_query = self.embedding.embed_documents([query])
-        deployed_index_id = self._get_index_id()
-        logger.debug(f"Deployed Index ID = {deployed_index_id}")
+    @staticmethod
+    def _parse_neighbors(response: dict, count: int) -> List[List[dict]]:
+        neighbors = {
+            query.get("id"): query.get("neighbors", [])
+            for query in response.get("nearestNeighbors", [])
+        }
+        return [neighbors.get(f"{i}", []) for i in range(count)]
 
+    def find_neighbors(
+        self,
+        embeddings: List[List[float]],
+        n_matches: Union[int, List[int]],
+        filters: Union[None, dict, List[Optional[dict]]] = None,
+    ) -> List[List[dict]]:
+        """Returns the raw neighbors of each query embedding, in query order."""
         # TO-DO: Pending query sdk integration
         # response = self.endpoint.match(
         #     deployed_index_id=self._get_index_id(),
-        #     queries=embedding_query,
-        #     num_neighbors=k,
+        #     queries=embeddings,
+        #     num_neighbors=n_matches,
         # )
 
-        response = self.get_matches(embedding_query, k, self.endpoint)
+        response = self.get_matches(embeddings, n_matches, self.endpoint, filters)
 
-        if response.status_code == 200:
-            response = response.json()["nearestNeighbors"]
-        else:
+        if response.status_code != 200:
             raise Exception(f"Failed to query index {str(response)}")
+        return self._parse_neighbors(response.json(), len(embeddings))
 
-        if len(response) == 0:
-            return []
-
-        logger.debug(f"Found {len(response)} matches for the query {query}.")
+    async def _auth_headers(self) -> Dict[str, str]:
+        if not self.credentials.valid:
+            # Refreshing is a blocking HTTP call, and only needed about hourly
+            await asyncio.to_thread(
+                self.credentials.refresh, google.auth.transport.requests.Request()
+            )
+        headers = {}
+        self.credentials.apply(headers)
+        return headers
+
+    async def _aio_session(self) -> aiohttp.ClientSession:
+        # Sessions are bound to the event loop they were created on
+        if self._aiohttp_session is None or self._aiohttp_session.closed:
+            self._aiohttp_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            )
+        return self._aiohttp_session
 
-        results = []
+    async def aclose(self) -> None:
+        if self._aiohttp_session is not None and not self._aiohttp_session.closed:
+            await self._aiohttp_session.close()
 
-        # Only getting the first one because queries receives an array
-        # and the similarity_search method only recevies one query. This
-        # means that the match method will always return an array with only
-        # one element.
-        for doc in response[0]["neighbors"]:
-            page_content = self._download_from_gcs(
-                f"documents/{doc['datapoint']['datapointId']}"
+    async def afind_neighbors(
+        self,
+        embeddings: List[List[float]],
+        n_matches: Union[int, List[int]],
+        filters: Union[None, dict, List[Optional[dict]]] = None,
+    ) -> List[List[dict]]:
+        rpc_address, endpoint_json_data = self._find_neighbors_request(
+            embeddings, n_matches, self.endpoint, filters
+        )
+        headers = await self._auth_headers()
+        headers["Content-Type"] = "application/json"
+        session = await self._aio_session()
+        async with session.post(
+            rpc_address, data=endpoint_json_data, headers=headers
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to query index {response.status}")
+            return self._parse_neighbors(await response.json(), len(embeddings))
+
+    def _find_neighbors_batch(self, queries: List[tuple]) -> List[List[dict]]:
+        embeddings = [embedding for embedding, _, _ in queries]
+        n_matches = [k for _, k, _ in queries]
+        filters = [filter for _, _, filter in queries]
+        return self.find_neighbors(embeddings, n_matches, filters)
+
+    async def _afind_neighbors_batch(self, queries: List[tuple]) -> List[List[dict]]:
+        embeddings = [embedding for embedding, _, _ in queries]
+        n_matches = [k for _, k, _ in queries]
+        filters = [filter for _, _, filter in queries]
+        return await self.afind_neighbors(embeddings, n_matches, filters)
+
+    @property
+    def query_batcher(self) -> MicroBatcher:
+        """Merges concurrent single-query searches into one findNeighbors call."""
+        if self._query_batcher is None:
+            self._query_batcher = MicroBatcher(
+                self._find_neighbors_batch,
+                window=self.query_batch_window,
+                max_batch_size=self.max_queries_per_request,
+                name="find-neighbors",
+                afunc=self._afind_neighbors_batch,
             )
+        return self._query_batcher
+
+    def _select_neighbors(
+        self,
+        neighbors: List[dict],
+        search_distance: float,
+    ) -> List[Tuple[str, dict]]:
+        # Apply the distance threshold before downloading anything, so we
+        # only pay for documents that are actually returned
+        selected = []
+        for doc in neighbors:
+            if "distance" in doc and doc["distance"] < search_distance:
+                continue
             metadata = {}
             if "restricts" in doc["datapoint"]:
                 metadata = {
@@ -195,36 +406,211 @@ class MatchingEngine(VectorStore):
                 }
             if "distance" in doc:
                 metadata["score"] = doc["distance"]
-                if doc["distance"] >= search_distance:
-                    results.append(
-                        Document(page_content=page_content, metadata=metadata)
-                    )
+            metadata["datapoint_id"] = doc["datapoint"]["datapointId"]
+            selected.append((doc["datapoint"]["datapointId"], metadata))
+        return selected
+
+    def _neighbors_to_documents(
+        self,
+        neighbors: List[dict],
+        search_distance: float,
+    ) -> List[Document]:
+        selected = self._select_neighbors(neighbors, search_distance)
+
+        if self.lazy_documents:
+            batch = _DocumentBatch(self, [datapoint_id for datapoint_id, _ in selected])
+            return [
+                LazyDocument(
+                    loader=lambda datapoint_id=datapoint_id: batch.get(datapoint_id),
+                    metadata=metadata,
+                )
+                for datapoint_id, metadata in selected
+            ]
+
+        contents = self.fetch_documents([datapoint_id for datapoint_id, _ in selected])
+        return [
+            Document(page_content=page_content, metadata=metadata)
+            for page_content, (_, metadata) in zip(contents, selected)
+        ]
+
+    def fetch_documents(self, datapoint_ids: List[str]) -> List[str]:
+        """Fetches document contents, downloading cache misses in parallel."""
+        contents = [self.document_cache.get(i) for i in datapoint_ids]
+        missing = [i for i, content in zip(datapoint_ids, contents) if content is None]
+        if missing and self.document_store is not None:
+            stored = self.document_store.get_many(missing)
+            for datapoint_id, page_content in stored.items():
+                self.document_cache.set(datapoint_id, page_content)
+            contents = [
+                content if content is not None else stored.get(i)
+                for i, content in zip(datapoint_ids, contents)
+            ]
+            missing = [i for i in missing if i not in stored]
+        if len(missing) == 1:
+            downloaded = {missing[0]: self._fetch_document(missing[0])}
+        elif missing:
+            downloaded = dict(
+                zip(missing, self._fetch_executor.map(self._fetch_document, missing))
+            )
+        else:
+            downloaded = {}
+        return [
+            content if content is not None else downloaded[i]
+            for i, content in zip(datapoint_ids, contents)
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, search_distance: float = 0.65, **kwargs: Any
+    ) -> List[Document]:
+        logger.debug(f"Embedding query {query}.")
+        filter = kwargs.get("filter")
+        embedding_query = self.embedding.embed_query(query)
+        logger.debug(f"Deployed Index ID = {self.deployed_index_id}")
+
+        try:
+            if self.query_batch_window:
+                neighbors = self.query_batcher((embedding_query, k, filter))
             else:
-                results.append(Document(page_content=page_content, metadata=metadata))
+                neighbors = self.find_neighbors([embedding_query], k, filter)[0]
+        except Exception as e:
+            if self.fallback_store is None:
+                raise
+            logger.warning(f"Matching Engine query failed, using local index: {e}")
+            return self.fallback_store.similarity_search_by_vector(
+                embedding_query, k, search_distance, **kwargs
+            )
+
+        if len(neighbors) == 0:
+            return []
+
+        logger.debug(f"Found {len(neighbors)} matches for the query {query}.")
+
+        results = self._neighbors_to_documents(neighbors, search_distance)
 
         logger.debug("Downloaded documents for query.")
 
         return results
 
+    def similarity_search_batch(
+        self,
+        queries: List[str],
+        k: int = 4,
+        search_distance: float = 0.65,
+        **kwargs: Any,
+    ) -> List[List[Document]]:
+        logger.debug(f"Embedding {len(queries)} queries.")
+        embeddings = self.embedding.embed_documents(list(queries))
+
+        results = []
+        for start in range(0, len(embeddings), self.max_queries_per_request):
+            batch = embeddings[start : start + self.max_queries_per_request]
+            for neighbors in self.find_neighbors(batch, k, kwargs.get("filter")):
+                results.append(self._neighbors_to_documents(neighbors, search_distance))
+
+        return results
+
+    async def afetch_documents(self, datapoint_ids: List[str]) -> List[str]:
+        contents = [self.document_cache.get(i) for i in datapoint_ids]
+        missing = [i for i, content in zip(datapoint_ids, contents) if content is None]
+        downloaded = {}
+        if missing and self.document_store is not None:
+            downloaded = await asyncio.to_thread(self.document_store.get_many, missing)
+            missing = [i for i in missing if i not in downloaded]
+        if missing:
+            session = await self._aio_session()
+            downloads = await asyncio.gather(
+                *(self._adownload_document(session, i) for i in missing)
+            )
+            downloaded.update(zip(missing, downloads))
+        for datapoint_id, page_content in downloaded.items():
+            if page_content:
+                self.document_cache.set(datapoint_id, page_content)
+        return [
+            content if content is not None else downloaded[i]
+            for i, content in zip(datapoint_ids, contents)
+        ]
+
+    async def _adownload_document(
+        self, session: aiohttp.ClientSession, datapoint_id: str
+    ) -> str:
+        gcs_location = f"documents/{datapoint_id}"
+        url = (
+            f"https://storage.googleapis.com/storage/v1/b/{self.gcs_bucket_name}"
+            f"/o/{quote(gcs_location, safe='')}?alt=media"
+        )
+        try:
+            async with session.get(url, headers=await self._auth_headers()) as response:
+                response.raise_for_status()
+                return await response.text(encoding="utf-8")
+        except Exception as e:
+            logger.error(f"Failed to download {gcs_location} from GCS: {e}")
+            return ""
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, search_distance: float = 0.65, **kwargs: Any
+    ) -> List[Document]:
+        filter = kwargs.get("filter")
+        embedding_query = await self.embedding.aembed_query(query)
+        try:
+            if self.query_batch_window:
+                # Shares findNeighbors requests with concurrent searches
+                neighbors = await self.query_batcher.asubmit(
+                    (embedding_query, k, filter)
+                )
+            else:
+                results = await self.afind_neighbors([embedding_query], k, filter)
+                neighbors = results[0]
+        except Exception as e:
+            if self.fallback_store is None:
+                raise
+            logger.warning(f"Matching Engine query failed, using local index: {e}")
+            # The local index may download documents, keep that off the loop
+            return await asyncio.to_thread(
+                self.fallback_store.similarity_search_by_vector,
+                embedding_query,
+                k,
+                search_distance,
+                **kwargs,
+            )
+
+        selected = self._select_neighbors(neighbors, search_distance)
+        contents = await self.afetch_documents(
+            [datapoint_id for datapoint_id, _ in selected]
+        )
+        return [
+            Document(page_content=page_content, metadata=metadata)
+            for page_content, (_, metadata) in zip(contents, selected)
+        ]
+
     def _get_index_id(self) -> str:
         for index in self.endpoint.deployed_indexes:
-            if index.index == self.index.name:
+            if index.index.split("/")[-1] == self.index_name.split("/")[-1]:
                 return index.id
 
         raise ValueError(
-            f"No index with id {self.index.name} "
+            f"No index with id {self.index_name} "
             f"deployed on enpoint "
             f"{self.endpoint.display_name}."
         )
 
-    def _download_from_gcs(self, gcs_location: str) -> str:
-        bucket = self.gcs_client.get_bucket(self.gcs_bucket_name)
+    def _download_from_gcs(self, gcs_location: str) -> Optional[str]:
         try:
-            blob = bucket.blob(gcs_location)
-            return blob.download_as_string()
+            blob = self.bucket.blob(gcs_location)
+            return blob.download_as_bytes().decode("utf-8")
         except Exception as e:
             logger.error(f"Failed to download {gcs_location} from GCS: {e}")
-            return ""
+            return None
+
+    def _fetch_document(self, datapoint_id: str) -> str:
+        page_content = self.document_cache.get(datapoint_id)
+        if page_content is None and self.document_store is not None:
+            page_content = self.document_store.get(datapoint_id)
+        if page_content is None:
+            page_content = self._download_from_gcs(f"documents/{datapoint_id}")
+            if page_content is None:
+                return ""
+            self.document_cache.set(datapoint_id, page_content)
+        return page_content
 
     @classmethod
     def from_texts(
@@ -266,7 +652,11 @@ class MatchingEngine(VectorStore):
         endpoint_id: str,
         credentials_path: Optional[str] = "creds/creds.json",
         embedding: Optional[Embeddings] = None,
+        deployed_index_id: Optional[str] = None,
+        **kwargs: Any,
     ) -> "MatchingEngine":
+        """Builds the store with a single control-plane call, the endpoint GET,
+        which also validates that index_id is deployed as deployed_index_id."""
         gcs_bucket_name = cls._validate_gcs_bucket(gcs_bucket_name)
 
         # Set credentials
@@ -277,10 +667,18 @@ class MatchingEngine(VectorStore):
             request = google.auth.transport.requests.Request()
             credentials.refresh(request)
 
-        index = cls._create_index_by_id(index_id, region, credentials)
         endpoint = cls._create_endpoint_by_id(
             endpoint_id, project_id, region, credentials
         )
+        if deployed_index_id and not any(
+            deployed.id == deployed_index_id
+            and deployed.index.split("/")[-1] == index_id.split("/")[-1]
+            for deployed in endpoint.deployed_indexes
+        ):
+            raise ValueError(
+                f"Index {index_id} is not deployed as {deployed_index_id} "
+                f"on endpoint {endpoint_id}."
+            )
 
         gcs_client = cls._get_gcs_client(credentials, project_id)
         index_client = cls._get_index_client(region, credentials)
@@ -290,7 +688,9 @@ class MatchingEngine(VectorStore):
         return cls(
             project_id=project_id,
             region=region,
-            index=index,
+            index=None,
+            index_name=index_id,
+            deployed_index_id=deployed_index_id,
             endpoint=endpoint,
             embedding=embedding or cls._get_default_embeddings(),
             gcs_client=gcs_client,
@@ -298,6 +698,7 @@ class MatchingEngine(VectorStore):
             index_endpoint_client=index_endpoint_client,
             credentials=credentials,
             gcs_bucket_name=gcs_bucket_name,
+            **kwargs,
         )
 
     @classmethod
@@ -387,6 +788,9 @@ class MatchingEngine(VectorStore):
         )
 
     @classmethod
-    def _get_default_embeddings(cls) -> TensorflowHubEmbeddings:
+    def _get_default_embeddings(cls) -> Embeddings:
         """This function returns the default embedding."""
+        # Imported here as TensorFlow Hub is heavy and only used as a fallback
+        from langchain_community.embeddings import TensorflowHubEmbeddings
+
         return TensorflowHubEmbeddings()
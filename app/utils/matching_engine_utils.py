@@ -1,7 +1,9 @@
 from datetime import datetime
+import json
 import logging
+import os
 import time
-from typing import Optional
+from typing import Dict, Optional
 
 from google.api_core.client_options import ClientOptions
 from google.cloud import aiplatform_v1 as aipv1
@@ -10,6 +12,8 @@ from google.protobuf import struct_pb2
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
+RESOURCE_KEYS = ("index_id", "index_endpoint_id", "deployed_index_id")
+
 
 class MatchingEngineUtils:
     def __init__(
@@ -283,6 +287,48 @@ class MatchingEngineUtils:
 
         return index_id, index_endpoint_id
 
+    def resolve_resources(
+        self,
+        cache_path: Optional[str] = None,
+        refresh: bool = False,
+        **configured: Optional[str],
+    ) -> Dict[str, str]:
+        """Returns the index, index endpoint and deployed index ids, taken from
+        `configured` values and the cache file when complete. Only lists the
+        project's indexes and endpoints on a miss or when `refresh` is set,
+        e.g. after the cached ids failed validation."""
+        if not refresh:
+            resources = {k: v for k, v in configured.items() if v}
+            if cache_path and os.path.exists(cache_path):
+                with open(cache_path, encoding="utf-8") as f:
+                    resources = {**json.load(f), **resources}
+            if all(resources.get(key) for key in RESOURCE_KEYS):
+                return resources
+
+        logger.info(f"Resolving Matching Engine resources for {self.index_name}")
+        index = self.get_index()
+        index_endpoint = self.get_index_endpoint()
+        if not index or not index_endpoint:
+            raise Exception(
+                f"Index {self.index_name} or endpoint {self.index_endpoint_name} "
+                "does not exist."
+            )
+        deployed_index_id = next(
+            (d.id for d in index_endpoint.deployed_indexes if d.index == index.name),
+            "",
+        )
+        resources = {
+            "index_id": index.name,
+            "index_endpoint_id": index_endpoint.name,
+            "deployed_index_id": deployed_index_id,
+        }
+        if cache_path:
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(resources, f)
+            os.replace(tmp_path, cache_path)
+        return resources
+
     def delete_index(self):
         # Check if index exists
         index = self.get_index()
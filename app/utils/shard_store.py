@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import storage
+
+logger = logging.getLogger(__name__)
+
+
+class ShardDocumentStore:
+    """Stores RAG document chunks packed into large shard objects in GCS,
+    with a compact id -> (shard, offset, length) index kept in memory.
+
+    Ingest costs one upload per shard instead of one per chunk, and reads are
+    served from a locally mirrored shard or a single ranged request per shard.
+    """
+
+    def __init__(
+        self,
+        bucket: storage.Bucket,
+        prefix: str = "shards",
+        chunks_per_shard: int = 2000,
+        mirror_dir: Optional[str] = None,
+        max_range_span: int = 4 * 1024 * 1024,
+    ) -> None:
+        self.bucket = bucket
+        self.prefix = prefix
+        self.chunks_per_shard = chunks_per_shard
+        self.mirror_dir = mirror_dir
+        self.max_range_span = max_range_span
+        self.shards: List[str] = []
+        self.index: Dict[str, Tuple[int, int, int]] = {}
+        self._pending: List[Tuple[str, bytes]] = []
+        self._lock = threading.Lock()
+        self._mirror_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        if mirror_dir:
+            os.makedirs(mirror_dir, exist_ok=True)
+        self.load_index()
+
+    @property
+    def index_blob(self) -> storage.Blob:
+        return self.bucket.blob(f"{self.prefix}/index.json")
+
+    def load_index(self) -> None:
+        blob = self.index_blob
+        if not blob.exists():
+            logger.info("No shard index found, starting an empty document store")
+            return
+        data = json.loads(blob.download_as_bytes())
+        with self._lock:
+            self.shards = data["shards"]
+            self.index = {
+                datapoint_id: tuple(location)
+                for datapoint_id, location in data["documents"].items()
+            }
+        logger.info(
+            f"Loaded shard index with {len(self.index)} documents "
+            f"in {len(self.shards)} shards"
+        )
+
+    def _write_index(self) -> None:
+        with self._lock:
+            data = {"shards": list(self.shards), "documents": dict(self.index)}
+        self.index_blob.upload_from_string(
+            json.dumps(data, separators=(",", ":")), content_type="application/json"
+        )
+
+    def add(self, datapoint_id: str, text: str) -> None:
+        with self._lock:
+            self._pending.append((datapoint_id, text.encode("utf-8")))
+            full = len(self._pending) >= self.chunks_per_shard
+        if full:
+            self._flush_shard()
+
+    def _flush_shard(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        shard_name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        locations, offset = {}, 0
+        for datapoint_id, data in pending:
+            locations[datapoint_id] = (offset, len(data))
+            offset += len(data)
+        payload = b"".join(data for _, data in pending)
+
+        self.bucket.blob(f"{self.prefix}/{shard_name}.bin").upload_from_string(payload)
+        if self.mirror_dir:
+            self._write_mirror(shard_name, payload)
+
+        with self._lock:
+            self.shards.append(shard_name)
+            shard_no = len(self.shards) - 1
+            for datapoint_id, (offset, length) in locations.items():
+                self.index[datapoint_id] = (shard_no, offset, length)
+        logger.info(f"Uploaded shard {shard_name} with {len(pending)} documents")
+
+    def flush(self) -> None:
+        self._flush_shard()
+        self._write_index()
+
+    def _mirror_path(self, shard_name: str) -> str:
+        return os.path.join(self.mirror_dir, f"{shard_name}.bin")
+
+    def _write_mirror(self, shard_name: str, payload: bytes) -> None:
+        tmp_path = f"{self._mirror_path(shard_name)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, self._mirror_path(shard_name))
+
+    def _ensure_mirrored(self, shard_name: str) -> str:
+        path = self._mirror_path(shard_name)
+        with self._mirror_locks[shard_name]:
+            if not os.path.exists(path):
+                blob = self.bucket.blob(f"{self.prefix}/{shard_name}.bin")
+                self._write_mirror(shard_name, blob.download_as_bytes())
+        return path
+
+    def _read_shard(
+        self, shard_name: str, locations: List[Tuple[str, int, int]]
+    ) -> Dict[str, str]:
+        if self.mirror_dir:
+            with open(self._ensure_mirrored(shard_name), "rb") as f:
+                return {
+                    datapoint_id: os.pread(f.fileno(), length, offset).decode("utf-8")
+                    for datapoint_id, offset, length in locations
+                }
+
+        blob = self.bucket.blob(f"{self.prefix}/{shard_name}.bin")
+        start = min(offset for _, offset, _ in locations)
+        end = max(offset + length for _, offset, length in locations)
+        if end - start <= self.max_range_span:
+            # One ranged read covering every requested document in this shard
+            data = blob.download_as_bytes(start=start, end=end - 1)
+            return {
+                datapoint_id: data[offset - start : offset - start + length].decode(
+                    "utf-8"
+                )
+                for datapoint_id, offset, length in locations
+            }
+        return {
+            datapoint_id: blob.download_as_bytes(
+                start=offset, end=offset + length - 1
+            ).decode("utf-8")
+            for datapoint_id, offset, length in locations
+        }
+
+    def get_many(self, datapoint_ids: List[str]) -> Dict[str, str]:
+        """Returns the contents of every id found in the index."""
+        by_shard = defaultdict(list)
+        with self._lock:
+            for datapoint_id in datapoint_ids:
+                if datapoint_id in self.index:
+                    shard_no, offset, length = self.index[datapoint_id]
+                    by_shard[self.shards[shard_no]].append(
+                        (datapoint_id, offset, length)
+                    )
+
+        contents = {}
+        for shard_name, locations in by_shard.items():
+            contents.update(self._read_shard(shard_name, locations))
+        return contents
+
+    def get(self, datapoint_id: str) -> Optional[str]:
+        return self.get_many([datapoint_id]).get(datapoint_id)
@@ -0,0 +1,85 @@
+"""Cold-start benchmark for the bot.
+
+Run from the app directory with the same environment as the bot:
+
+    python utils/startup_benchmark.py --top 25
+
+It reports the slowest imports of main.py (via ``python -X importtime``)
+and the time from process start until the bot logs that it is ready.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+READY_RE = re.compile(r"Ready in ([\d.]+)s")
+
+
+def import_times(module: str = "main") -> List[Tuple[str, int, int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if match := IMPORT_TIME_RE.match(line):
+            self_us, cumulative_us, indent, name = match.groups()
+            depth = (len(indent) - 1) // 2
+            times.append((name, int(self_us), int(cumulative_us), depth))
+    if not times:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr[-2000:]}")
+    return times
+
+
+def time_to_ready(timeout: float = 300) -> Tuple[float, float]:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=APP_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    try:
+        for line in process.stdout:
+            if match := READY_RE.search(line):
+                return time.perf_counter() - start, float(match.group(1))
+            if time.perf_counter() - start > timeout:
+                break
+        raise RuntimeError("Bot did not become ready")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--skip-ready", action="store_true")
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total_ms = sum(t[1] for t in times) / 1000
+    print(f"Importing {args.module}: {total_ms:.0f} ms over {len(times)} modules\n")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us, depth in sorted(
+        times, key=lambda t: t[2], reverse=True
+    )[: args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+    if not args.skip_ready:
+        wall, reported = time_to_ready()
+        print(f"\nTime to on_ready: {wall:.2f}s wall, {reported:.2f}s reported by bot")
+
+
+if __name__ == "__main__":
+    main()
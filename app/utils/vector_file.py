@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the column indices and values of the k highest scores of each
+    row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-values, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(
+        values, order, axis=1
+    )
+
+
+class VectorFile:
+    """Corpus vectors stored as a contiguous float32 matrix with a parallel id
+    array, opened read-only through memory maps so that every worker process
+    shares the same pages in the page cache instead of holding its own copy.
+
+    With int8 codes present, searches scan the codes (a quarter of the size)
+    and only re-score the best candidates against the float32 rows.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.count, self.dim = meta["count"], meta["dim"]
+        shape = (self.count, self.dim)
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.vectors = np.memmap(
+            os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r", shape=shape
+        )
+        self.codes = self.scales = None
+        if meta.get("quantized"):
+            self.codes = np.memmap(
+                os.path.join(path, "codes.i8"), dtype=np.int8, mode="r", shape=shape
+            )
+            self.scales = np.memmap(
+                os.path.join(path, "scales.f32"),
+                dtype=np.float32,
+                mode="r",
+                shape=(self.count,),
+            )
+        self.metadatas: List[dict] = meta.get("metadatas") or [{}] * self.count
+
+    def __len__(self) -> int:
+        return self.count
+
+    @classmethod
+    def write(
+        cls,
+        path: str,
+        ids: Sequence[str],
+        vectors: np.ndarray,
+        metadatas: Optional[List[dict]] = None,
+        quantize: bool = True,
+    ) -> "VectorFile":
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        os.makedirs(path, exist_ok=True)
+
+        def replace(name: str, data: np.ndarray) -> None:
+            tmp_path = os.path.join(path, f"{name}.tmp")
+            data.tofile(tmp_path)
+            os.replace(tmp_path, os.path.join(path, name))
+
+        replace("vectors.f32", vectors)
+        if quantize:
+            # Symmetric per-vector scale so each row uses the full int8 range
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            codes = np.round(vectors / scales[:, None]).astype(np.int8)
+            replace("codes.i8", codes)
+            replace("scales.f32", scales.astype(np.float32))
+
+        with open(os.path.join(path, "ids.npy.tmp"), "wb") as f:
+            np.save(f, np.asarray(ids, dtype=str))
+        os.replace(os.path.join(path, "ids.npy.tmp"), os.path.join(path, "ids.npy"))
+        # meta.json is written last, readers never see a partially written set
+        meta = {
+            "count": vectors.shape[0],
+            "dim": vectors.shape[1],
+            "quantized": quantize,
+            "metadatas": metadatas,
+        }
+        with open(os.path.join(path, "meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+        logger.info(f"Wrote {vectors.shape[0]} vectors to {path}")
+        return cls(path)
+
+    def _scan(
+        self, queries: np.ndarray, k: int, chunk_size: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.count, chunk_size):
+            end = min(start + chunk_size, self.count)
+            if self.codes is not None:
+                scores = (
+                    queries @ self.codes[start:end].astype(np.float32).T
+                ) * self.scales[start:end]
+            else:
+                scores = queries @ self.vectors[start:end].T
+            positions = np.broadcast_to(
+                np.arange(start, end), (len(queries), end - start)
+            )
+            idx, best_scores = top_k(np.hstack([best_scores, scores]), k)
+            best_idx = np.take_along_axis(np.hstack([best_idx, positions]), idx, axis=1)
+        return best_idx, best_scores
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int = 4,
+        rescore_factor: int = 4,
+        chunk_size: int = 8192,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k positions and dot product scores of each query row."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if self.codes is None:
+            return self._scan(queries, k, chunk_size)
+
+        candidates, _ = self._scan(queries, k * rescore_factor, chunk_size)
+        # Only the candidate rows of the float32 matrix are paged in
+        exact = np.einsum("mcd,md->mc", self.vectors[candidates], queries)
+        idx, scores = top_k(exact, k)
+        return np.take_along_axis(candidates, idx, axis=1), scores